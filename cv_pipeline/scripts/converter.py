@@ -15,15 +15,38 @@ def load_config(path=DEFAULT_CONFIG):
         return yaml.safe_load(file)
 
 
-def pt2onnx(model_path=None, config_path=DEFAULT_CONFIG):
+def fix_spatial_dims(onnx_path, image_size):
+    """
+    Делает высоту и ширину входа ONNX-модели фиксированными, оставляя
+    динамическим только батч. Ultralytics при dynamic=True делает
+    динамическими все оси сразу.
+    """
+    import onnx
+
+    model = onnx.load(onnx_path)
+    dims = model.graph.input[0].type.tensor_type.shape.dim
+    for dim in dims[2:4]:
+        dim.ClearField("dim_param")
+        dim.dim_value = image_size
+    onnx.save(model, onnx_path)
+
+
+def pt2onnx(model_path=None, config_path=DEFAULT_CONFIG, profile=None):
     """
     Экспортирует модель в формат ONNX.
     Если model_path не указан, берет путь к весам из конфига.
+    profile — имя профиля экспорта из export.profiles (по умолчанию export.profile).
     """
     # 1. Загрузка настроек
     cfg = load_config(config_path)
     train_cfg = cfg["training"]
     paths_cfg = cfg["paths"]
+    export_cfg = cfg.get("export", {})
+    profile = profile or export_cfg.get("profile", "static")
+    profile_cfg = export_cfg.get("profiles", {}).get(profile)
+    if profile_cfg is None:
+        print(f"--- [ERROR] Профиль экспорта не найден: {profile}")
+        return None
 
     # Определяем путь к модели
     # Если мы только что обучили модель, она лежит в project/name/weights/best.pt
@@ -41,18 +64,28 @@ def pt2onnx(model_path=None, config_path=DEFAULT_CONFIG):
     model = YOLO(model_path)
 
     # 3. Экспорт
-    # Параметры берем из конфига (image_size) или используем стандарты
+    # Параметры берем из конфига (image_size, профиль) или используем стандарты
+    image_size = train_cfg.get("image_size", 640)
+    dynamic_batch = profile_cfg.get("dynamic_batch", False)
+    dynamic_hw = profile_cfg.get("dynamic_hw", False)
+    print(
+        f"--- [INFO] Профиль {profile}: batch={profile_cfg.get('batch', 1)}, "
+        f"динамический батч={dynamic_batch}, динамическое разрешение={dynamic_hw}"
+    )
     onnx_path = model.export(
         format="onnx",
-        imgsz=train_cfg.get("image_size", 640),
-        opset=12,
+        imgsz=image_size,
+        batch=profile_cfg.get("batch", 1),
+        opset=profile_cfg.get("opset", 12),
         simplify=True,
-        dynamic=False,
+        dynamic=dynamic_batch or dynamic_hw,
         half=False,
         optimize=True,
         device="cpu",  # Экспорт на CPU более стабилен
         nms=True,
     )
+    if dynamic_batch and not dynamic_hw:
+        fix_spatial_dims(onnx_path, image_size)
 
     print(f"--- [FINISH] Экспорт завершен! Файл сохранен: {onnx_path}")
     return onnx_path
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import platform
+import importlib.util
+from datetime import datetime, timezone
+import cv2
+import numpy as np
+import yaml
+import onnxruntime as ort
+from ultralytics import YOLO
+
+# --- КОНСТАНТЫ ---
+DEFAULT_CONFIG = "config/config.yaml"
+# Имена моделей, которые обслуживает backend (ключи MODEL_PATHS в cv_site)
+MODEL_NAMES = ("nano", "small", "medium", "large")
+ORT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# --- ФУНКЦИИ ---
+
+
+def load_config(path=DEFAULT_CONFIG):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Конфиг не найден: {path}")
+    with open(path, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+def onnx_runner(onnx_path, level, threads):
+    """Сессия ONNX Runtime с заданным уровнем оптимизации графа."""
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ORT_LEVELS[level]
+    options.intra_op_num_threads = threads
+    session = ort.InferenceSession(
+        onnx_path, options, providers=["CPUExecutionProvider"]
+    )
+    input_name = session.get_inputs()[0].name
+    return lambda batch: session.run(None, {input_name: batch})[0]
+
+
+def torchscript_runner(path, threads):
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    module = torch.jit.load(path, map_location="cpu").eval()
+
+    def run(batch):
+        with torch.inference_mode():
+            pred = module(torch.from_numpy(batch))
+        return (pred[0] if isinstance(pred, (list, tuple)) else pred).numpy()
+
+    return run
+
+
+def openvino_runner(model_dir, threads):
+    import openvino as ov
+
+    core = ov.Core()
+    xml = next(f for f in os.listdir(model_dir) if f.endswith(".xml"))
+    config = {"INFERENCE_NUM_THREADS": threads} if threads else {}
+    compiled = core.compile_model(os.path.join(model_dir, xml), "CPU", config)
+    return lambda batch: compiled(batch)[0]
+
+
+def postprocess(pred, confidence, iou):
+    """
+    Общий постпроцессинг сырых выходов YOLO (batch, 4 + классы, anchors):
+    фильтр по уверенности и NMS по каждому кадру. Все форматы экспортируются
+    без NMS в графе и замеряются вместе с этим шагом — одинаковая работа.
+    """
+    boxes = []
+    for frame in pred:
+        frame = frame.T  # (anchors, 4 + классы)
+        scores = frame[:, 4:].max(axis=1)
+        keep = scores > confidence
+        xywh, scores = frame[keep, :4], scores[keep]
+        if not len(scores):
+            boxes.append(xywh)
+            continue
+        # NMSBoxes ждёт (x, y, w, h) с левым верхним углом
+        xywh = xywh.copy()
+        xywh[:, :2] -= xywh[:, 2:] / 2
+        index = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), confidence, iou)
+        boxes.append(xywh[np.asarray(index, dtype=int).reshape(-1)])
+    return boxes
+
+
+def benchmark(
+    run, batch_sizes, image_size, runs=20, warmup=3, confidence=0.25, iou=0.5
+):
+    """
+    Микробенчмарк по размерам батча на случайных входах: forward pass
+    вместе с общим постпроцессингом.
+    :return: {batch: {"latency_ms": медиана, "fps": кадров/с}} — только для
+        батчей, которые бэкенд принял
+    """
+
+    def step(batch):
+        return postprocess(run(batch), confidence, iou)
+
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.random.rand(batch_size, 3, image_size, image_size).astype(
+            np.float32
+        )
+        try:
+            for _ in range(warmup):
+                step(batch)
+        except Exception as e:
+            print(f"--- [SKIP] batch={batch_size}: {e}")
+            continue
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            step(batch)
+            times.append(time.perf_counter() - start)
+        latency = float(np.median(times))
+        results[batch_size] = {
+            "latency_ms": round(latency * 1000, 2),
+            "fps": round(batch_size / latency, 2),
+        }
+        print(
+            f"    batch={batch_size}: {results[batch_size]['latency_ms']} мс, "
+            f"{results[batch_size]['fps']} кадр/с"
+        )
+    return results
+
+
+def export_artifacts(model, image_size, formats, opset):
+    """
+    Экспортирует модель в форматы для CPU.
+    :return: [(бэкенд, путь)]; недоступные форматы пропускаются
+    """
+    artifacts = []
+    for fmt in formats:
+        # Без проверки Ultralytics попытается доустановить openvino сам
+        if fmt == "openvino" and importlib.util.find_spec("openvino") is None:
+            print("--- [SKIP] OpenVINO не установлен")
+            continue
+        print(f"--- [EXPORT] {fmt}")
+        try:
+            # Без NMS в графе, как и остальные форматы: backend (ONNXDetector)
+            # ждёт сырые выходы и делает постпроцессинг сам
+            options = {"opset": opset} if fmt == "onnx" else {}
+            path = model.export(
+                format=fmt,
+                imgsz=image_size,
+                dynamic=fmt != "torchscript",  # динамический батч
+                half=False,
+                device="cpu",
+                **options,
+            )
+        except Exception as e:
+            print(f"--- [SKIP] Экспорт {fmt} не удался: {e}")
+            continue
+        artifacts.append((fmt, str(path)))
+    return artifacts
+
+
+def export_and_benchmark(name, model_path=None, config_path=DEFAULT_CONFIG):
+    """
+    Экспортирует best.pt в бэкенды для CPU (ONNX с разными уровнями
+    оптимизации графа, TorchScript, OpenVINO при наличии), замеряет скорость
+    каждого на этой машине по размерам батча и записывает манифест с самым
+    быстрым артефактом. Его читает backend (переменная MODEL_MANIFEST).
+    :param name: имя модели в манифесте — ключ MODEL_PATHS backend (MODEL_NAMES);
+        запись под другим именем backend не читает
+    :return: запись манифеста для модели
+    """
+    if name not in MODEL_NAMES:
+        raise ValueError(
+            f"Имя модели {name!r} не обслуживается backend, ожидается одно из: "
+            f"{', '.join(MODEL_NAMES)}"
+        )
+    cfg = load_config(config_path)
+    train_cfg = cfg["training"]
+    paths_cfg = cfg["paths"]
+    bench_cfg = cfg.get("benchmark", {})
+
+    if model_path is None:
+        model_path = os.path.join(
+            paths_cfg["output_dir"], train_cfg["exp_name"], "weights", "best.pt"
+        )
+    if not os.path.exists(model_path):
+        print(f"--- [ERROR] Модель для экспорта не найдена по пути: {model_path}")
+        return None
+
+    image_size = train_cfg.get("image_size", 640)
+    batch_sizes = bench_cfg.get("batch_sizes", [1, 4, 8, 16])
+    target_batch = bench_cfg.get("target_batch", 16)
+    threads = cfg["general"].get("num_threads", 0)
+    runs = bench_cfg.get("runs", 20)
+    warmup = bench_cfg.get("warmup_runs", 3)
+    confidence = bench_cfg.get("confidence", 0.25)
+    iou = bench_cfg.get("iou", 0.5)
+
+    print(f"--- [START] Экспорт и замеры: {model_path}")
+    model = YOLO(model_path)
+    artifacts = export_artifacts(
+        model,
+        image_size,
+        bench_cfg.get("formats", ["onnx", "torchscript", "openvino"]),
+        bench_cfg.get("opset", 17),
+    )
+
+    candidates = []
+    for backend, path in artifacts:
+        if backend == "onnx":
+            variants = [
+                ({"graph_optimization": level}, onnx_runner(path, level, threads))
+                for level in bench_cfg.get("onnx_levels", ["basic", "extended", "all"])
+            ]
+        elif backend == "torchscript":
+            variants = [({}, torchscript_runner(path, threads))]
+        else:
+            variants = [({}, openvino_runner(path, threads))]
+        for options, run in variants:
+            print(f"--- [BENCH] {backend} {options or ''}")
+            results = benchmark(
+                run, batch_sizes, image_size, runs, warmup, confidence, iou
+            )
+            if results:
+                candidates.append(
+                    {
+                        "backend": backend,
+                        "path": os.path.abspath(path),
+                        "options": options,
+                        "results": results,
+                    }
+                )
+
+    if not candidates:
+        print("--- [ERROR] Ни один бэкенд не прошел замеры")
+        return None
+
+    def score(candidate):
+        # Пропускная способность на рабочем батче (или ближайшем замеренном)
+        results = candidate["results"]
+        batch = min(results, key=lambda b: (abs(b - target_batch), -b))
+        return results[batch]["fps"]
+
+    best = max(candidates, key=score)
+    entry = {
+        "source": os.path.abspath(model_path),
+        "image_size": image_size,
+        "best": {k: best[k] for k in ("backend", "path", "options")},
+        "candidates": candidates,
+    }
+
+    manifest_path = bench_cfg.get("manifest", "outputs/model_manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        # Замеры с другой машины здесь не годятся
+        if manifest.get("host") != platform.node():
+            manifest = {}
+    manifest.update(
+        {
+            "host": platform.node(),
+            "cpu": platform.processor() or platform.machine(),
+            "cores": os.cpu_count(),
+            "updated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+    )
+    manifest.setdefault("models", {})[name] = entry
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print(
+        f"--- [FINISH] Быстрее всего: {best['backend']} {best['options'] or ''} "
+        f"({score(best)} кадр/с). Манифест: {manifest_path}"
+    )
+    return entry
+
+
+# --- ТОЧКА ВХОДА ---
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        sys.exit(
+            "Использование: python scripts/export_benchmark.py <best.pt> <имя модели>, "
+            f"имя — одно из: {', '.join(MODEL_NAMES)}"
+        )
+    export_and_benchmark(sys.argv[2], sys.argv[1])
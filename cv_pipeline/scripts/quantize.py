@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import random
+import cv2
+import numpy as np
+import yaml
+import onnxruntime as ort
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from ultralytics import YOLO
+
+# --- КОНСТАНТЫ ---
+DEFAULT_CONFIG = "config/config.yaml"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# --- ФУНКЦИИ ---
+
+
+def load_config(path=DEFAULT_CONFIG):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Конфиг не найден: {path}")
+    with open(path, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+def list_images(folder, limit=None, seed=42):
+    """Случайная выборка изображений из папки (воспроизводимая по seed)."""
+    images = sorted(
+        os.path.join(folder, f)
+        for f in os.listdir(folder)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    random.Random(seed).shuffle(images)
+    return images[:limit] if limit else images
+
+
+def letterbox(image, size):
+    """
+    Вписывает кадр BGR в квадрат size x size с сохранением пропорций,
+    как при инференсе в backend.
+    :return: np.ndarray (3, size, size) float32, RGB, 0..1
+    """
+    height, width = image.shape[:2]
+    gain = min(size / height, size / width)
+    new_w, new_h = max(1, round(width * gain)), max(1, round(height * gain))
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top, left = (size - new_h) // 2, (size - new_w) // 2
+    canvas[top : top + new_h, left : left + new_w] = cv2.resize(image, (new_w, new_h))
+    return canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+
+
+def model_input(onnx_path, image_size, session=None):
+    """:return: (имя входа, фиксированный батч или None, размер стороны)"""
+    if session is None:
+        session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    meta = session.get_inputs()[0]
+    batch = meta.shape[0] if isinstance(meta.shape[0], int) else None
+    size = meta.shape[2] if isinstance(meta.shape[2], int) else image_size
+    return meta.name, batch, size
+
+
+def iter_batches(images, batch, size, pad=False):
+    """
+    Батчи входов модели.
+    :param pad: добивать неполный последний батч первым кадром — для модели
+        с фиксированным батчем; при динамическом батче он остаётся коротким
+    """
+    for i in range(0, len(images), batch):
+        blobs = [letterbox(cv2.imread(path), size) for path in images[i : i + batch]]
+        if pad:
+            blobs += [blobs[0]] * (batch - len(blobs))
+        yield np.stack(blobs)
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Отдаёт калибровочные батчи из изображений val-выборки."""
+
+    def __init__(self, images, input_name, batch, size):
+        self.input_name = input_name
+        self._batches = iter_batches(images, batch, size, pad=True)
+
+    def get_next(self):
+        blob = next(self._batches, None)
+        return None if blob is None else {self.input_name: blob}
+
+
+def quantize_int8(onnx_path, config_path=DEFAULT_CONFIG, output_path=None):
+    """
+    Статическая INT8-квантизация (QDQ) ONNX-модели с калибровкой на val.
+    :return: путь к квантизованной модели
+    """
+    cfg = load_config(config_path)
+    quant_cfg = cfg.get("quantization", {})
+    image_size = cfg["training"].get("image_size", 640)
+    output_path = output_path or onnx_path.replace(".onnx", ".int8.onnx")
+
+    val_dir = os.path.join(cfg["paths"]["dataset_dir"], "images", "val")
+    images = list_images(
+        val_dir, quant_cfg.get("calibration_images", 200), cfg["split"]["seed"]
+    )
+    if not images:
+        raise FileNotFoundError(f"Нет изображений для калибровки в {val_dir}")
+
+    input_name, batch, size = model_input(onnx_path, image_size)
+    print(f"--- [START] Калибровка INT8 на {len(images)} изображениях из {val_dir}")
+
+    # Подготовка графа (shape inference, оптимизация) улучшает квантизацию
+    prepared_path = onnx_path.replace(".onnx", ".prep.onnx")
+    try:
+        quant_pre_process(onnx_path, prepared_path)
+        quantize_static(
+            prepared_path,
+            output_path,
+            ImageCalibrationReader(images, input_name, batch or 1, size),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=quant_cfg.get("per_channel", True),
+            calibrate_method=getattr(
+                CalibrationMethod, quant_cfg.get("calibrate_method", "MinMax")
+            ),
+        )
+    finally:
+        if os.path.exists(prepared_path):
+            os.remove(prepared_path)
+
+    print(f"--- [FINISH] INT8-модель сохранена: {output_path}")
+    return output_path
+
+
+def benchmark_speed(onnx_path, images, image_size, batch=8, warmup=5, threads=0):
+    """
+    Замер скорости на CPU.
+    :return: задержка одиночного кадра (медиана и p95, мс) и пропускная
+        способность батчами (кадров/с)
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    session = ort.InferenceSession(
+        onnx_path, options, providers=["CPUExecutionProvider"]
+    )
+    input_name, fixed_batch, size = model_input(onnx_path, image_size, session)
+
+    # Задержка: по одному кадру (модель с фиксированным батчем — полным батчем)
+    single = list(iter_batches(images, fixed_batch or 1, size, pad=True))
+    for blob in single[:warmup]:
+        session.run(None, {input_name: blob})
+    latencies = []
+    for blob in single:
+        start = time.perf_counter()
+        session.run(None, {input_name: blob})
+        latencies.append((time.perf_counter() - start) * 1000)
+    del single
+
+    # Пропускная способность: батчами
+    batch = fixed_batch or batch
+    batches = list(iter_batches(images, batch, size, pad=fixed_batch is not None))
+    start = time.perf_counter()
+    for blob in batches:
+        session.run(None, {input_name: blob})
+    elapsed = time.perf_counter() - start
+
+    return {
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+        # Кадры-заглушки из добитого батча не считаются
+        "throughput_fps": round(len(images) / elapsed, 2),
+        "batch": batch,
+    }
+
+
+def evaluate_map(onnx_path, data_yaml, image_size, batch):
+    """mAP модели на test-выборке через валидатор Ultralytics."""
+    metrics = YOLO(onnx_path, task="detect").val(
+        data=data_yaml,
+        split="test",
+        imgsz=image_size,
+        batch=batch or 1,
+        device="cpu",
+        plots=False,
+        verbose=False,
+    )
+    return {
+        "map50": round(float(metrics.box.map50), 4),
+        "map50_95": round(float(metrics.box.map), 4),
+    }
+
+
+def compare_fp32_int8(
+    onnx_path, int8_path=None, config_path=DEFAULT_CONFIG, report_path=None
+):
+    """
+    Сравнивает FP32 и INT8 модели на test-выборке: задержка, пропускная
+    способность и mAP. Если int8_path не указан, модель квантизуется.
+    :return: отчет (dict), сохраняется в JSON рядом с INT8-моделью
+    """
+    cfg = load_config(config_path)
+    quant_cfg = cfg.get("quantization", {})
+    image_size = cfg["training"].get("image_size", 640)
+    dataset_dir = cfg["paths"]["dataset_dir"]
+    data_yaml = os.path.join(dataset_dir, "data.yaml")
+
+    if int8_path is None:
+        int8_path = quantize_int8(onnx_path, config_path)
+
+    test_dir = os.path.join(dataset_dir, "images", "test")
+    images = list_images(
+        test_dir, quant_cfg.get("benchmark_images", 100), cfg["split"]["seed"]
+    )
+    if not images:
+        raise FileNotFoundError(f"Нет изображений для замера в {test_dir}")
+
+    report = {"images": len(images)}
+    for name, path in (("fp32", onnx_path), ("int8", int8_path)):
+        print(f"--- [BENCH] {name}: {path}")
+        _, fixed_batch, _ = model_input(path, image_size)
+        report[name] = {
+            "path": path,
+            "size_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+            **benchmark_speed(
+                path,
+                images,
+                image_size,
+                batch=quant_cfg.get("benchmark_batch", 8),
+                warmup=quant_cfg.get("warmup_runs", 5),
+                threads=cfg["general"].get("num_threads", 0),
+            ),
+            **evaluate_map(path, data_yaml, image_size, fixed_batch),
+        }
+
+    fp32, int8 = report["fp32"], report["int8"]
+    report["delta"] = {
+        "map50": round(int8["map50"] - fp32["map50"], 4),
+        "map50_95": round(int8["map50_95"] - fp32["map50_95"], 4),
+        "latency_speedup": round(fp32["latency_ms_p50"] / int8["latency_ms_p50"], 2),
+        "throughput_speedup": round(
+            int8["throughput_fps"] / fp32["throughput_fps"], 2
+        ),
+    }
+
+    print("\n--- [REPORT] FP32 vs INT8 ---")
+    print(f"{'':>8} {'p50, мс':>9} {'p95, мс':>9} {'кадр/с':>9} {'mAP50':>7} {'МБ':>7}")
+    for name in ("fp32", "int8"):
+        r = report[name]
+        print(
+            f"{name:>8} {r['latency_ms_p50']:>9} {r['latency_ms_p95']:>9} "
+            f"{r['throughput_fps']:>9} {r['map50']:>7} {r['size_mb']:>7}"
+        )
+    delta = report["delta"]
+    print(
+        f"Ускорение: x{delta['latency_speedup']} (задержка), "
+        f"x{delta['throughput_speedup']} (пропускная способность); "
+        f"ΔmAP50 = {delta['map50']:+.4f}"
+    )
+
+    report_path = report_path or int8_path.replace(".onnx", ".report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"--- [FINISH] Отчет сохранен: {report_path}")
+    return report
+
+
+# --- ТОЧКА ВХОДА ---
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Использование: python scripts/quantize.py model.onnx [model.int8.onnx]")
+        sys.exit(1)
+    compare_fp32_int8(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
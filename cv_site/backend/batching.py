@@ -0,0 +1,79 @@
+import asyncio
+
+
+class MicroBatcher:
+    """
+    Склеивает одновременные запросы с одинаковым ключом (модель, conf, iou)
+    в один батчевый forward pass.
+
+    Батч уходит в работу, когда набралось max_batch_size элементов или
+    прошло max_wait секунд с момента прихода первого. Пока по ключу
+    выполняется батч, новые запросы копятся и уходят следующим батчем.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait=0.01):
+        """
+        :param run_batch: async-функция (key, items) -> список результатов
+            той же длины и в том же порядке, что и items
+        :param max_batch_size: максимальный размер батча
+        :param max_wait: максимальное ожидание добора батча, секунд
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = {}  # key -> [(item, future), ...]
+        self._timers = {}  # key -> asyncio.TimerHandle
+        self._busy = set()  # ключи, по которым сейчас идёт инференс
+        self._tasks = set()
+
+    @property
+    def queue_depth(self):
+        return sum(len(items) for items in self._pending.values())
+
+    async def submit(self, key, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if key in self._busy:
+            # Батч уйдёт сразу после завершения текущего
+            return
+        batch = self._pending.pop(key, [])
+        # Запросы, которые отменил клиент, в модель не отправляем
+        batch = [(item, fut) for item, fut in batch if not fut.done()]
+        if not batch:
+            return
+        rest = batch[self.max_batch_size :]
+        batch = batch[: self.max_batch_size]
+        if rest:
+            self._pending[key] = rest
+        self._busy.add(key)
+        task = asyncio.ensure_future(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, batch):
+        try:
+            results = await self.run_batch(key, [item for item, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self._busy.discard(key)
+            if self._pending.get(key):
+                self._flush(key)
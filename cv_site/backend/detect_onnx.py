@@ -1,37 +1,141 @@
 # cv_tgbot/detect.py
+import ast
+import multiprocessing as mp
 import os
+import queue
 import cv2
-import glob
-import shutil
-import onnxruntime as ort
 import numpy as np
 import time
+from concurrent.futures import ProcessPoolExecutor
+
+from detections import ColumnarDetections
+from detectors import CONFIDENCE, IOU
+from frame_skip import KEYFRAME_THRESHOLD, KeyframeSelector, interpolate_boxes
+from onnx_session import SessionPool
+from postprocess import postprocess_batch, split_by_frame
+from preprocess import INPUT_SIZE, LetterboxBatch
+from stages import END, StagePipeline
+from video_encoder import FFmpegPipeWriter, budget_bitrate, concat_videos
+from video_shards import available_cores, plan_shards, probe_keyframes, shard_threads
+
+
+def _process_shard(model_path, session_options, input_path, output_path, options):
+    """Обработка одного отрезка видео в процессе-воркере со своей сессией."""
+    # Декодер OpenCV тоже многопоточный — ограничиваем его долей ядер воркера
+    cv2.setNumThreads(max(1, session_options.get("intra_op_threads") or 1))
+    detector = ONNXDetector(model_path, **session_options)
+    detections = []
+    stats = detector._process_video(
+        input_path, output_path, detections=detections, **options
+    )
+    return detections, stats
 
 
 class ONNXDetector:
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 МБ
+    CONFIDENCE = CONFIDENCE
+    IOU = IOU
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, sessions=1, **session_options):
+        """
+        :param sessions: число сессий ONNX Runtime (параллельных запросов)
+        :param session_options: настройки SessionPool: intra_op_threads,
+            inter_op_threads, graph_optimization, optimized_model_path,
+            enable_mem_arena, enable_mem_pattern, providers
+        """
         self.model_path = model_path
+        self.session_options = session_options
+        # Сессии создаются один раз и переиспользуются всеми запросами
+        self.sessions = SessionPool(model_path, size=sessions, **session_options)
+        # Строковые размерности входа (batch, height, ...) — динамические оси
+        shape = self.sessions.input_shape
+        self.fixed_batch = shape[0] if isinstance(shape[0], int) else None
+        self.input_size = shape[2] if isinstance(shape[2], int) else INPUT_SIZE
+        self.class_names = self._read_class_names()
 
-    @staticmethod
-    def compress_video(input_path, output_path, target_bitrate="1M"):
-        import subprocess
+    def _read_class_names(self):
+        # Ultralytics пишет имена классов в метаданные модели: "{0: 'soldier'}"
+        session = self.sessions.sessions[0].session
+        meta = session.get_modelmeta().custom_metadata_map
+        try:
+            names = ast.literal_eval(meta.get("names", "{}"))
+        except (ValueError, SyntaxError):
+            return []
+        if isinstance(names, dict):
+            return [names[i] for i in sorted(names)]
+        return list(names)
 
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-i",
-            input_path,
-            "-b:v",
-            target_bitrate,
-            "-bufsize",
-            target_bitrate,
-            "-vf",
-            "scale=trunc(iw/2)*2:trunc(ih/2)*2",
-            output_path,
-        ]
-        subprocess.run(cmd, check=True)
+    def _batch_size(self, requested, frames=None):
+        """
+        Размер батча для вызова. Модель с фиксированным батчем принимает
+        только его; для динамической батч не больше числа кадров.
+        :param frames: сколько кадров предстоит обработать, если известно
+        """
+        if self.fixed_batch:
+            return self.fixed_batch
+        if frames:
+            requested = min(requested, frames)
+        return max(1, requested)
+
+    def warmup(self):
+        """Прогревочный проход, чтобы первый запрос не платил за инициализацию."""
+        self.detect_batch([np.zeros((self.input_size, self.input_size, 3), np.uint8)])
+
+    def _inputs(self, session, batch_size):
+        """
+        Входной батч, закреплённый за сессией пула: берётся вместе с ней,
+        поэтому буферов не больше, чем сессий, сколько бы потоков ни было.
+        """
+        inputs = session.inputs
+        if inputs is None or len(inputs.batch) < batch_size:
+            inputs = session.inputs = LetterboxBatch(batch_size, self.input_size)
+        return inputs
+
+    def detect_batch(self, frames, confidence=None, iou=None):
+        """
+        Один проход модели по списку кадров (общий интерфейс детекторов).
+        :param frames: список путей к файлам или numpy-массивов (BGR)
+        :return: ColumnarDetections, frame_idx — индекс кадра в frames
+        """
+        confidence = self.CONFIDENCE if confidence is None else confidence
+        iou = self.IOU if iou is None else iou
+        frames = [cv2.imread(f) if isinstance(f, str) else f for f in frames]
+        if not frames:
+            return ColumnarDetections.empty(self.class_names)
+        batch_size = self._batch_size(len(frames))
+        timings = {"preprocess": 0.0, "predict": 0.0, "postprocess": 0.0}
+        parts = []
+        with self.sessions.session() as session:
+            inputs = self._inputs(session, batch_size)
+            for first in range(0, len(frames), batch_size):
+                chunk = frames[first : first + batch_size]
+                start = time.perf_counter()
+                for i, frame in enumerate(chunk):
+                    inputs.put(i, frame)
+                size = batch_size if self.fixed_batch else len(chunk)
+                preprocessed = time.perf_counter()
+                pred = session.run(inputs.batch[:size])[0][: len(chunk)]
+                predicted = time.perf_counter()
+                frame_idx, xyxy, conf, class_id = self._boxes(
+                    pred, inputs, confidence, iou
+                )
+                parts.append((frame_idx + first, xyxy, conf, class_id))
+                timings["preprocess"] += preprocessed - start
+                timings["predict"] += predicted - preprocessed
+                timings["postprocess"] += time.perf_counter() - predicted
+        frame_idx, xyxy, conf, class_id = (np.concatenate(c) for c in zip(*parts))
+        dets = ColumnarDetections.from_xyxy(
+            frame_idx, class_id, conf, xyxy, self.class_names, len(frames)
+        )
+        dets.timings = timings
+        return dets
+
+    def predict_frames(self, frames, confidence=None, iou=None):
+        """
+        То же, что detect_batch, но в старом формате.
+        :return: список детекций для каждого кадра, в том же порядке
+        """
+        return self.detect_batch(frames, confidence, iou).to_frame_lists()
 
     def run_on_image(
         self,
@@ -44,51 +148,16 @@ class ONNXDetector:
             raise ValueError(
                 f"Размер файла превышает {self.MAX_FILE_SIZE // (1024*1024)} МБ"
             )
-        providers = (
-            ["CUDAExecutionProvider", "CPUExecutionProvider"]
-            if "CUDAExecutionProvider" in ort.get_available_providers()
-            else ["CPUExecutionProvider"]
-        )
-        session = ort.InferenceSession(self.model_path, providers=providers)
-        input_name = session.get_inputs()[0].name
         img = cv2.imread(input_image_path)
-        orig = img.copy()
-        height, width = img.shape[:2]
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img_resized = cv2.resize(img_rgb, (640, 640))
-        img_input = img_resized.astype(np.float32) / 255.0
-        img_input = np.transpose(img_input, (2, 0, 1))
-        img_input = np.expand_dims(img_input, axis=0)
-        outputs = session.run(None, {input_name: img_input})
-        pred = outputs[0][0]
-        boxes, scores, class_ids = [], [], []
-        for det in pred:
-            conf = det[4]
-            if conf < confidence_threshold:
-                continue
-            x1, y1, x2, y2 = det[0:4]
-            cls = int(det[5]) if det.shape[0] > 5 else 0
-            x1 = int(x1 / 640 * width)
-            y1 = int(y1 / 640 * height)
-            x2 = int(x2 / 640 * width)
-            y2 = int(y2 / 640 * height)
-            boxes.append([x1, y1, x2, y2])
-            scores.append(float(conf))
-            class_ids.append(cls)
-        idxs = cv2.dnn.NMSBoxes(boxes, scores, confidence_threshold, iou_threshold)
-        for i in idxs.flatten():
-            x1, y1, x2, y2 = boxes[i]
-            cv2.rectangle(orig, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(
-                orig,
-                str(class_ids[i]),
-                (x1, y1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (0, 255, 0),
-                2,
+        inputs = LetterboxBatch(self._batch_size(1), self.input_size)
+        inputs.put(0, img)
+        with self.sessions.session() as session:
+            pred = session.run(inputs.batch)[0][:1]
+            ((boxes, _, class_ids),) = self._postprocess(
+                pred, inputs, confidence_threshold, iou_threshold
             )
-        cv2.imwrite(output_image_path, orig)
+        self._draw(img, boxes, class_ids)
+        cv2.imwrite(output_image_path, img)
 
     def run_on_video(
         self,
@@ -97,27 +166,225 @@ class ONNXDetector:
         confidence_threshold=0.32,
         iou_threshold=0.5,
         batch_size=16,
-        compress_if_larger_than=None,  # в байтах, если None - не сжимать
+        compress_if_larger_than=None,  # бюджет размера в байтах, None - без ограничения
+        max_stride=1,
+        shards=1,
+        detections=None,
     ):
+        """
+        :param shards: на сколько отрезков делить видео для параллельной
+            обработки в отдельных процессах (1 — в текущем процессе)
+        :param detections: список, куда добавляются детекции по кадрам
+        :return: статистика обработки
+        """
         if os.path.getsize(input_video_path) > self.MAX_FILE_SIZE:
             raise ValueError(
                 f"Размер файла превышает {self.MAX_FILE_SIZE // (1024*1024)} МБ"
             )
-        self._process_video(
+        if shards > 1:
+            return self._process_video_sharded(
+                input_video_path,
+                output_video_path,
+                shards,
+                confidence_threshold,
+                iou_threshold,
+                batch_size,
+                max_stride,
+                max_bytes=compress_if_larger_than,
+                detections=detections,
+            )
+        return self._process_video(
             input_video_path,
             output_video_path,
             confidence_threshold,
             iou_threshold,
             batch_size,
+            max_stride,
+            max_bytes=compress_if_larger_than,
+            detections=detections,
+        )
+
+    @staticmethod
+    def _boxes(pred, inputs, confidence_threshold, iou_threshold):
+        """
+        Детекции батча в координатах исходных кадров после NMS.
+        :param pred: выход модели (B, N, 6)
+        :param inputs: LetterboxBatch, из которого собран вход модели
+        :return: (frame_idx, xyxy, conf, class_id), упорядочены по кадрам
+        """
+        return postprocess_batch(
+            pred,
+            confidence_threshold,
+            iou_threshold,
+            gain=np.repeat(inputs.gains[: len(pred), None], 2, axis=1),
+            pad=inputs.pads[: len(pred)],
+            shapes=inputs.shapes[: len(pred)],
+        )
+
+    @classmethod
+    def _postprocess(cls, pred, inputs, confidence_threshold, iou_threshold):
+        """
+        Детекции батча, разбитые по кадрам.
+        :return: список по кадрам из (xyxy (K, 4), scores (K,), class_ids (K,))
+        """
+        frame_idx, xyxy, conf, class_id = cls._boxes(
+            pred, inputs, confidence_threshold, iou_threshold
         )
-        # Если нужно, сжимаем видео после обработки
-        if (
-            compress_if_larger_than is not None
-            and os.path.getsize(output_video_path) > compress_if_larger_than
-        ):
-            compressed_path = output_video_path.replace(".mp4", "_compressed.mp4")
-            self.compress_video(output_video_path, compressed_path)
-            shutil.move(compressed_path, output_video_path)
+        return split_by_frame(frame_idx, len(pred), xyxy, conf, class_id)
+
+    @staticmethod
+    def _draw(frame, boxes, class_ids):
+        for (x1, y1, x2, y2), cls in zip(boxes.astype(int).tolist(), class_ids):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(
+                frame,
+                str(cls),
+                (x1, y1 - 10),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.9,
+                (0, 255, 0),
+                2,
+            )
+
+    def _write_frame(self, out, free, frame, dets, detections):
+        """
+        Рисует детекции на кадре, пишет его в видео и возвращает буфер в кольцо.
+        :param dets: (xyxy, scores, class_ids) или None
+        :param detections: список детекций по кадрам или None
+        """
+        if dets is not None:
+            self._draw(frame, dets[0], dets[2])
+        out.write(frame)
+        free.put(frame)
+        if detections is not None:
+            detections.append(dets)
+
+    def _write_resolved(self, out, pending, prev, free, detections=None):
+        """
+        Записывает кадры из pending до последнего ключевого кадра с готовыми
+        детекциями. Боксы кадров между ключевыми интерполируются.
+        :param pending: список [кадр, ключевой ли, детекции или None]
+        :param prev: детекции последнего записанного ключевого кадра
+        :param free: очередь свободных буферов — записанные кадры возвращаются туда
+        :return: детекции последнего записанного ключевого кадра
+        """
+        resolved = [i for i, item in enumerate(pending) if item[2] is not None]
+        written = 0
+        for pos in resolved:
+            key = pending[pos][2]
+            gap = pos - written
+            if gap and prev is not None:
+                ts = np.arange(1, gap + 1, dtype=np.float32) / (gap + 1)
+                frame_i, xyxy, conf, cls = interpolate_boxes(prev, key, ts)
+                for i in range(gap):
+                    keep = frame_i == i
+                    dets = (xyxy[keep], conf[keep], cls[keep])
+                    frame = pending[written + i][0]
+                    self._write_frame(out, free, frame, dets, detections)
+            else:
+                for item in pending[written:pos]:
+                    self._write_frame(out, free, item[0], None, detections)
+            self._write_frame(out, free, pending[pos][0], key, detections)
+            written = pos + 1
+            prev = key
+        del pending[:written]
+        return prev
+
+    def _decode_stage(
+        self, pipeline, cap, selector, free, batches, to_infer, max_frames=None
+    ):
+        """
+        Стадия декодирования: читает кадры в буферы кольца, выбирает ключевые
+        и пишет их во входной батч. Отдаёт дальше порции
+        (кадры [кадр, ключевой ли, None], LetterboxBatch или None, число ключевых).
+        :param max_frames: сколько кадров прочитать (None — до конца видео)
+        """
+        frames, inputs, count = [], None, 0
+        while max_frames is None or pipeline.items["decode"] < max_frames:
+            # Кольцо исчерпано: ключевые кадры порции нужны, чтобы освободить буферы
+            if count and free.empty():
+                pipeline.put(to_infer, (frames, inputs, count))
+                frames, inputs, count = [], None, 0
+            if inputs is None:
+                inputs = pipeline.get(batches)
+            buffer = pipeline.get(free)
+            with pipeline.busy("decode"):
+                ret, frame = cap.read(buffer)
+                if ret:
+                    is_key = selector.is_keyframe(frame)
+                    frames.append([frame, is_key, None])
+                    if is_key:
+                        inputs.put(count, frame)
+                        count += 1
+                    pipeline.items["decode"] += 1
+                else:
+                    free.put(buffer)
+            if not ret:
+                break
+            if count == inputs.batch.shape[0]:
+                pipeline.put(to_infer, (frames, inputs, count))
+                frames, inputs, count = [], None, 0
+        if not count and inputs is not None:
+            batches.put(inputs)
+            inputs = None
+        if frames:
+            pipeline.put(to_infer, (frames, inputs, count))
+        pipeline.put(to_infer, END)
+
+    def _infer_stage(
+        self,
+        pipeline,
+        to_infer,
+        to_render,
+        batches,
+        confidence_threshold,
+        iou_threshold,
+    ):
+        """Стадия инференса: детекции ключевых кадров порции за один батч."""
+        while True:
+            chunk = pipeline.get(to_infer)
+            if chunk is END:
+                break
+            frames, inputs, count = chunk
+            if count:
+                with pipeline.busy("infer"):
+                    # Динамический батч режется по числу кадров (срез без копии).
+                    # При фиксированном в хвосте неполного батча остаются
+                    # прошлые кадры, их выходы отбрасываются
+                    batch = inputs.batch if self.fixed_batch else inputs.batch[:count]
+                    # Выходы живут в буферах сессии: разбираем их, не отдавая сессию
+                    with self.sessions.session() as session:
+                        outputs = session.run(batch)
+                        frame_dets = self._postprocess(
+                            outputs[0][:count],
+                            inputs,
+                            confidence_threshold,
+                            iou_threshold,
+                        )
+                    keyframes = (item for item in frames if item[1])
+                    for dets, item in zip(frame_dets, keyframes):
+                        item[2] = dets
+                batches.put(inputs)
+                pipeline.items["infer"] += count
+            pipeline.put(to_render, frames)
+        pipeline.put(to_render, END)
+
+    def _render_stage(self, pipeline, out, free, to_render, detections=None):
+        """Стадия отрисовки и кодирования: кадры пишутся строго по порядку."""
+        pending = []  # кадры, ещё не записанные в видео
+        prev = None
+        while True:
+            frames = pipeline.get(to_render)
+            if frames is END:
+                break
+            with pipeline.busy("render"):
+                pending += frames
+                prev = self._write_resolved(out, pending, prev, free, detections)
+                pipeline.items["render"] += len(frames)
+        with pipeline.busy("render"):
+            # После последнего ключевого кадра следующего нет: повторяем его боксы
+            for item in pending:
+                self._write_frame(out, free, item[0], prev, detections)
 
     def _process_video(
         self,
@@ -126,131 +393,215 @@ class ONNXDetector:
         confidence_threshold=0.32,
         iou_threshold=0.5,
         batch_size=16,
+        max_stride=1,
+        keyframe_threshold=KEYFRAME_THRESHOLD,
+        max_bytes=None,
+        queue_size=2,
+        start_frame=0,
+        end_frame=None,
+        detections=None,
     ):
+        """
+        Декодирование, инференс и отрисовка с кодированием идут параллельно
+        в отдельных стадиях, связанных ограниченными очередями.
+        :param batch_size: желаемый размер батча; у модели с фиксированным
+            батчем используется её собственный
+        :param max_stride: максимальный шаг между ключевыми кадрами; модель
+            запускается только на ключевых, боксы остальных интерполируются
+            (1 — модель на каждом кадре)
+        :param max_bytes: бюджет размера выходного видео; битрейт ограничивается
+            при кодировании, без повторного сжатия
+        :param queue_size: сколько порций может ждать между соседними стадиями
+        :param start_frame: первый кадр обрабатываемого отрезка
+        :param end_frame: конец отрезка, не включительно (None — до конца видео)
+        :param detections: список, куда добавляются детекции по кадрам:
+            (xyxy, scores, class_ids) или None, если детекций для кадра нет
+        :return: статистика загрузки стадий
+        """
+        cap = None
+        out = None
         try:
-            providers = (
-                ["CUDAExecutionProvider", "CPUExecutionProvider"]
-                if "CUDAExecutionProvider" in ort.get_available_providers()
-                else ["CPUExecutionProvider"]
-            )
-            session = ort.InferenceSession(self.model_path, providers=providers)
-            input_name = session.get_inputs()[0].name
             cap = cv2.VideoCapture(input_video_path)
-            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-            fps = cap.get(cv2.CAP_PROP_FPS)
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
-            frames = []
-            orig_frames = []
-            infer_times = []
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                orig_frames.append(frame.copy())
-                img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                img = cv2.resize(img, (640, 640))
-                img = img.astype(np.float32) / 255.0
-                img = np.transpose(img, (2, 0, 1))
-                frames.append(img)
-                if len(frames) == batch_size:
-                    batch = np.stack(frames, axis=0)
-                    start_time = time.time()
-                    outputs = session.run(None, {input_name: batch})
-                    infer_time = (time.time() - start_time) * 1000 / batch_size
-                    infer_times.extend([infer_time] * batch_size)
-                    pred = outputs[0]
-                    for idx, dets in enumerate(pred):
-                        frame = orig_frames[idx]
-                        boxes, scores, class_ids = [], [], []
-                        for det in dets:
-                            conf = det[4]
-                            if conf < confidence_threshold:
-                                continue
-                            x1, y1, x2, y2 = det[0:4]
-                            cls = int(det[5]) if det.shape[0] > 5 else 0
-                            x1 = int(x1 / 640 * width)
-                            y1 = int(y1 / 640 * height)
-                            x2 = int(x2 / 640 * width)
-                            y2 = int(y2 / 640 * height)
-                            boxes.append([x1, y1, x2, y2])
-                            scores.append(float(conf))
-                            class_ids.append(cls)
-                        idxs = cv2.dnn.NMSBoxes(
-                            boxes, scores, confidence_threshold, iou_threshold
-                        )
-                        for i in idxs.flatten():
-                            x1, y1, x2, y2 = boxes[i]
-                            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                            cv2.putText(
-                                frame,
-                                str(class_ids[i]),
-                                (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX,
-                                0.9,
-                                (0, 255, 0),
-                                2,
-                            )
-                        out.write(frame)
-                    frames = []
-                    orig_frames = []
-            # Обработка оставшихся кадров (если их < batch_size)
-            if frames:
-                pad = batch_size - len(frames)
-                for _ in range(pad):
-                    frames.append(frames[-1])
-                    orig_frames.append(orig_frames[-1])
-                batch = np.stack(frames, axis=0)
-                start_time = time.time()
-                outputs = session.run(None, {input_name: batch})
-                infer_time = (time.time() - start_time) * 1000 / batch_size
-                infer_times.extend([infer_time] * len(frames))
-                pred = outputs[0]
-                for idx in range(len(frames) - pad):
-                    dets = pred[idx]
-                    frame = orig_frames[idx]
-                    boxes, scores, class_ids = [], [], []
-                    for det in dets:
-                        conf = det[4]
-                        if conf < confidence_threshold:
-                            continue
-                        x1, y1, x2, y2 = det[0:4]
-                        cls = int(det[5]) if det.shape[0] > 5 else 0
-                        x1 = int(x1 / 640 * width)
-                        y1 = int(y1 / 640 * height)
-                        x2 = int(x2 / 640 * width)
-                        y2 = int(y2 / 640 * height)
-                        boxes.append([x1, y1, x2, y2])
-                        scores.append(float(conf))
-                        class_ids.append(cls)
-                    idxs = cv2.dnn.NMSBoxes(
-                        boxes, scores, confidence_threshold, iou_threshold
-                    )
-                    for i in idxs.flatten():
-                        x1, y1, x2, y2 = boxes[i]
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        cv2.putText(
-                            frame,
-                            str(class_ids[i]),
-                            (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.9,
-                            (0, 255, 0),
-                            2,
-                        )
-                    out.write(frame)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if start_frame:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            max_frames = None if end_frame is None else end_frame - start_frame
+            duration = (max_frames or frame_count - start_frame) / fps
+            batch_size = self._batch_size(batch_size, max_frames or frame_count)
+            # Размеченные кадры сразу кодируются в итоговый MP4 за один проход
+            out = FFmpegPipeWriter(
+                output_video_path,
+                width,
+                height,
+                fps,
+                max_bitrate=budget_bitrate(max_bytes, duration),
+            )
+            selector = KeyframeSelector(max_stride, keyframe_threshold)
+            # Кольцо буферов исходных кадров: декодер пишет в свободный буфер,
+            # после записи в видео буфер возвращается. Пустое кольцо тормозит
+            # декодер, а не растит память. Два батча кадров — один декодируется,
+            # пока другой у модели; между ключевыми кадрами не больше max_stride
+            ring_size = 2 * batch_size + max_stride
+            free = queue.Queue()
+            for _ in range(ring_size):
+                free.put(np.empty((height, width, 3), np.uint8))
+            # Два входных батча: один заполняет декодер, пока другой у модели
+            batches = queue.Queue()
+            for _ in range(2):
+                batches.put(LetterboxBatch(batch_size, self.input_size))
+            to_infer = queue.Queue(maxsize=queue_size)
+            to_render = queue.Queue(maxsize=queue_size)
+            pipeline = StagePipeline()
+            pipeline.spawn(
+                "decode",
+                self._decode_stage,
+                pipeline,
+                cap,
+                selector,
+                free,
+                batches,
+                to_infer,
+                max_frames,
+            )
+            pipeline.spawn(
+                "render", self._render_stage, pipeline, out, free, to_render, detections
+            )
+            pipeline.run(
+                self._infer_stage,
+                pipeline,
+                to_infer,
+                to_render,
+                batches,
+                confidence_threshold,
+                iou_threshold,
+            )
+            pipeline.join()
             cap.release()
-            out.release()
-            if infer_times:
+            out.close()
+            stats = pipeline.stats()
+            keyframes = pipeline.items["infer"]
+            if keyframes:
+                infer_time = pipeline.busy_time["infer"] * 1000 / keyframes
+                print(
+                    f"Среднее время инференса на кадр: {infer_time:.2f} мс (batch={batch_size})"
+                )
+            if max_stride > 1:
+                print(f"Ключевых кадров: {selector.keyframes}, шаг до {max_stride}")
+            for stage, stage_stats in stats["stages"].items():
                 print(
-                    f"Среднее время инференса на кадр: {np.mean(infer_times):.2f} мс (batch={batch_size})"
+                    f"Стадия {stage}: загрузка {stage_stats['utilization']:.0%}, "
+                    f"{stage_stats['busy_sec']:.2f} с из {stats['elapsed_sec']:.2f} с"
                 )
             print(f"Размеченное видео сохранено в: {output_video_path}")
+            return stats
         except Exception as e:
             print(f"Ошибка при обработке видео: {e}")
+            if cap is not None:
+                cap.release()
+            if out is not None:
+                out.abort()
             raise
 
+    def _process_video_sharded(
+        self,
+        input_video_path,
+        output_video_path,
+        shards,
+        confidence_threshold=0.32,
+        iou_threshold=0.5,
+        batch_size=16,
+        max_stride=1,
+        max_bytes=None,
+        detections=None,
+    ):
+        """
+        Делит видео на отрезки по ключевым кадрам и обрабатывает их параллельно
+        в процессах-воркерах, у каждого своя сессия ONNX Runtime. Закодированные
+        отрезки склеиваются без перекодирования, детекции — по порядку кадров.
+        :return: статистика по отрезкам
+        """
+        cap = cv2.VideoCapture(input_video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        try:
+            keyframes = probe_keyframes(input_video_path, fps)
+        except (OSError, RuntimeError) as e:
+            print(f"Не удалось найти ключевые кадры, обработка без шардов: {e}")
+            keyframes = []
+        segments = plan_shards(keyframes, frame_count, shards, min_frames=batch_size)
+        options = {
+            "confidence_threshold": confidence_threshold,
+            "iou_threshold": iou_threshold,
+            "batch_size": batch_size,
+            "max_stride": max_stride,
+        }
+        if len(segments) < 2:
+            return self._process_video(
+                input_video_path,
+                output_video_path,
+                max_bytes=max_bytes,
+                detections=detections,
+                **options,
+            )
+        workers = min(len(segments), available_cores())
+        # Ядра делятся между воркерами поровну, чтобы потоки не конкурировали
+        # 0 или None в настройках сессии — "решает ORT", т.е. все ядра
+        # в каждом воркере: такие значения заменяются долей ядер
+        session_options = dict(self.session_options)
+        if not session_options.get("intra_op_threads"):
+            session_options["intra_op_threads"] = shard_threads(workers)
+        if not session_options.get("inter_op_threads"):
+            session_options["inter_op_threads"] = 1
+        parts = [f"{output_video_path}.part{i}.mp4" for i in range(len(segments))]
+        start_time = time.perf_counter()
+        pool = ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"))
+        try:
+            futures = []
+            for part, (start, end) in zip(parts, segments):
+                shard_options = dict(options, start_frame=start, end_frame=end)
+                if max_bytes:
+                    # Бюджет размера делится пропорционально длине отрезков
+                    share = (end - start) / frame_count
+                    shard_options["max_bytes"] = int(max_bytes * share)
+                futures.append(
+                    pool.submit(
+                        _process_shard,
+                        self.model_path,
+                        session_options,
+                        input_video_path,
+                        part,
+                        shard_options,
+                    )
+                )
+            results = [future.result() for future in futures]
+            concat_videos(parts, output_video_path)
+        finally:
+            pool.shutdown(cancel_futures=True)
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
+        if detections is not None:
+            for shard_detections, _ in results:
+                detections.extend(shard_detections)
+        elapsed = time.perf_counter() - start_time
+        threads = session_options["intra_op_threads"]
+        print(
+            f"Видео обработано в {len(segments)} отрезках ({workers} процессов, "
+            f"{threads} потоков на процесс) за {elapsed:.2f} с"
+        )
+        return {
+            "elapsed_sec": round(elapsed, 3),
+            "workers": workers,
+            "shards": [
+                dict(stats, start_frame=start, end_frame=end)
+                for (_, stats), (start, end) in zip(results, segments)
+            ],
+        }
+
     if __name__ == "__main__":
         # Пример использования для тестирования detect.py
         # Убедитесь, что у вас есть test_video.mp4 и модель в cv_tgbot/model/
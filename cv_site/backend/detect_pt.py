@@ -2,57 +2,80 @@
 import os
 from ultralytics import YOLO
 import cv2
-import glob
-import shutil
+import numpy as np
+import threading
+import time
+
+from detections import ColumnarDetections
+from detectors import CONFIDENCE, IMGSZ, IOU
+from video_encoder import FFmpegPipeWriter, budget_bitrate
 
 
 class PTDetector:
     MAX_FILE_SIZE = 49 * 1024 * 1024  # 49 МБ
-    CONFIDENCE = 0.32
-    IOU = 0.5
+    CONFIDENCE = CONFIDENCE
+    IOU = IOU
     DEVICE = "cuda"
+    IMGSZ = IMGSZ
 
-    def __init__(self, model_path, confidence=CONFIDENCE, iou=IOU, device=DEVICE):
+    def __init__(
+        self, model_path, confidence=CONFIDENCE, iou=IOU, device=DEVICE, imgsz=IMGSZ
+    ):
         self.model_path = model_path
         self.model = YOLO(model_path)
         self.confidence = confidence
         self.iou = iou
         self.device = device
-
-    @staticmethod
-    def compress_video(input_path, output_path, target_bitrate="1M"):
-        import subprocess
-
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-i",
-            input_path,
-            "-b:v",
-            target_bitrate,
-            "-bufsize",
-            target_bitrate,
-            "-vf",
-            "scale=trunc(iw/2)*2:trunc(ih/2)*2",
-            output_path,
-        ]
-        subprocess.run(cmd, check=True)
-
-    @staticmethod
-    def convert_avi_to_mp4(input_path, output_path):
-        cap = cv2.VideoCapture(input_path)
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            out.write(frame)
-        cap.release()
-        out.release()
+        self.imgsz = imgsz
+        # ultralytics-модель не потокобезопасна, а инференс идёт из пула потоков
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        """Прогревочный forward pass, чтобы первый запрос не платил за инициализацию."""
+        self.predict_frames([np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)])
+
+    def memory_bytes(self):
+        """Память под веса и буферы модели."""
+        module = self.model.model
+        if not hasattr(module, "parameters"):
+            # Экспортированная модель (ONNX, OpenVINO...) — память учтёт замер RSS
+            return 0
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def detect_batch(self, frames, confidence=None, iou=None):
+        """
+        Один батчевый forward pass по списку кадров.
+        :param frames: список путей к файлам или numpy-массивов (BGR)
+        :return: ColumnarDetections, frame_idx — индекс кадра в frames
+        """
+        confidence = self.confidence if confidence is None else confidence
+        iou = self.iou if iou is None else iou
+        with self._lock:
+            start = time.perf_counter()
+            results = self.model.predict(
+                source=list(frames),
+                conf=confidence,
+                iou=iou,
+                imgsz=self.imgsz,
+                device=self.device,
+                batch=len(frames),
+                verbose=False,
+            )
+        predicted = time.perf_counter()
+        dets = ColumnarDetections.from_results(results, self.model.names, confidence)
+        dets.timings = {
+            "predict": predicted - start,
+            "postprocess": time.perf_counter() - predicted,
+        }
+        return dets
+
+    def predict_frames(self, frames, confidence=None, iou=None):
+        """
+        То же, что detect_batch, но в старом формате.
+        :return: список детекций для каждого кадра, в том же порядке
+        """
+        return self.detect_batch(frames, confidence, iou).to_frame_lists()
 
     def run_on_image(
         self,
@@ -100,46 +123,33 @@ class PTDetector:
             raise ValueError(
                 f"Размер файла превышает {self.MAX_FILE_SIZE // (1024*1024)} МБ"
             )
+        cap = cv2.VideoCapture(input_video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
         try:
-            results = self.model.track(
-                source=input_video_path,
-                conf=self.confidence,
-                iou=self.iou,
-                tracker="bytetrack.yaml",
-                save=True,
-                project=os.path.dirname(output_video_path),
-                name=os.path.splitext(os.path.basename(output_video_path))[0],
-                exist_ok=True,
-                device=self.device,
+            # Один проход: размеченные кадры сразу кодируются в MP4, битрейт
+            # ограничен так, чтобы файл уложился в MAX_FILE_SIZE
+            writer = FFmpegPipeWriter(
+                output_video_path,
+                width,
+                height,
+                fps,
+                max_bitrate=budget_bitrate(self.MAX_FILE_SIZE, frame_count / fps),
             )
-            save_dir = results[0].save_dir
-            output_basename = os.path.splitext(os.path.basename(input_video_path))[0]
-            video_patterns = [f"{output_basename}.*"]
-            found_files = []
-            for pattern in video_patterns:
-                found_files.extend(glob.glob(os.path.join(save_dir, pattern)))
-            found_files = [
-                f
-                for f in found_files
-                if os.path.splitext(f)[1].lower()
-                in [".avi", ".mp4", ".mov", ".mkv", ".wmv"]
-            ]
-            if found_files:
-                actual_output_video_path = found_files[0]
-                ext = os.path.splitext(actual_output_video_path)[1].lower()
-                if ext == ".avi":
-                    self.convert_avi_to_mp4(actual_output_video_path, output_video_path)
-                    os.remove(actual_output_video_path)
-                else:
-                    os.rename(actual_output_video_path, output_video_path)
-            else:
-                raise FileNotFoundError(
-                    f"Размеченное видео не найдено после инференса."
-                )
-            if os.path.getsize(output_video_path) > self.MAX_FILE_SIZE:
-                compressed_path = output_video_path.replace(".mp4", "_compressed.mp4")
-                self.compress_video(output_video_path, compressed_path)
-                shutil.move(compressed_path, output_video_path)
+            with writer:
+                for result in self.model.track(
+                    source=input_video_path,
+                    conf=self.confidence,
+                    iou=self.iou,
+                    tracker="bytetrack.yaml",
+                    stream=True,
+                    device=self.device,
+                    verbose=False,
+                ):
+                    writer.write(result.plot())
         except Exception as e:
             print(f"Ошибка при обработке видео: {e}")
             raise
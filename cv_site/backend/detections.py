@@ -0,0 +1,230 @@
+import json
+import struct
+
+import numpy as np
+
+BINARY_MAGIC = b"RPTD"
+BINARY_VERSION = 1
+
+# Колонки и их типы в бинарном формате (little-endian)
+COLUMN_DTYPES = {
+    "frame_idx": np.dtype("<u4"),
+    "class_id": np.dtype("<u2"),
+    "conf": np.dtype("<f4"),
+    "x": np.dtype("<i4"),
+    "y": np.dtype("<i4"),
+    "w": np.dtype("<i4"),
+    "h": np.dtype("<i4"),
+}
+
+
+def class_table(names):
+    """Имена классов ultralytics (dict или list) -> список, где индекс = id класса."""
+    if isinstance(names, dict):
+        size = max(names) + 1 if names else 0
+        return [names.get(i, str(i)) for i in range(size)]
+    return list(names)
+
+
+class ColumnarDetections:
+    """
+    Детекции в виде struct-of-arrays: по одному плоскому массиву на поле
+    (frame_idx, class_id, conf, x, y, w, h) и общая таблица имён классов.
+    """
+
+    def __init__(self, frame_idx, class_id, conf, xywh, class_names, num_frames):
+        self.frame_idx = np.asarray(frame_idx, dtype=np.int64)
+        self.class_id = np.asarray(class_id, dtype=np.int64)
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.xywh = np.asarray(xywh, dtype=np.int64).reshape(-1, 4)
+        self.class_names = list(class_names)
+        self.num_frames = num_frames
+        # Время этапов, за которые получены детекции: {"predict": сек, ...}
+        self.timings = {}
+        # Для видео с пропуском кадров: bool на кадр — работала ли на нём модель
+        # (False — боксы интерполированы). None — модель работала на всех кадрах
+        self.inferred = None
+
+    def __len__(self):
+        return len(self.conf)
+
+    @classmethod
+    def empty(cls, class_names=(), num_frames=0):
+        return cls([], [], [], np.zeros((0, 4)), class_names, num_frames)
+
+    @classmethod
+    def from_xyxy(cls, frame_idx, class_id, conf, xyxy, class_names, num_frames):
+        """Из боксов (x1, y1, x2, y2); координаты отбрасывают дробную часть, как int()."""
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        xywh = np.empty(xyxy.shape, dtype=np.int64)
+        xywh[:, :2] = np.trunc(xyxy[:, :2])
+        xywh[:, 2:] = np.trunc(xyxy[:, 2:] - xyxy[:, :2])
+        return cls(frame_idx, class_id, conf, xywh, class_names, num_frames)
+
+    @classmethod
+    def from_results(cls, results, names, confidence):
+        """
+        Собирает детекции батча из результатов ultralytics целыми тензорами,
+        без цикла по отдельным боксам. frame_idx — индекс кадра в батче.
+        """
+        xyxy, conf, cls_ids, frame_idx = [], [], [], []
+        for i, result in enumerate(results):
+            boxes = result.boxes
+            c = boxes.conf.cpu().numpy()
+            keep = c >= confidence
+            xyxy.append(boxes.xyxy.cpu().numpy()[keep])
+            conf.append(c[keep])
+            cls_ids.append(boxes.cls.cpu().numpy()[keep])
+            frame_idx.append(np.full(int(keep.sum()), i))
+        if not results:
+            return cls.empty(class_table(names))
+        return cls.from_xyxy(
+            np.concatenate(frame_idx),
+            np.concatenate(cls_ids),
+            np.concatenate(conf),
+            np.concatenate(xyxy),
+            class_table(names),
+            len(results),
+        )
+
+    @classmethod
+    def concat(cls, parts, offsets=None):
+        """
+        Склеивает несколько батчей.
+        :param offsets: смещение frame_idx для каждой части (по умолчанию подряд)
+        """
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        if offsets is None:
+            offsets = np.cumsum([0] + [p.num_frames for p in parts[:-1]])
+        num_frames = int(max(o + p.num_frames for o, p in zip(offsets, parts)))
+        merged = cls(
+            np.concatenate([p.frame_idx + o for p, o in zip(parts, offsets)]),
+            np.concatenate([p.class_id for p in parts]),
+            np.concatenate([p.conf for p in parts]),
+            np.concatenate([p.xywh for p in parts]),
+            parts[0].class_names,
+            num_frames,
+        )
+        for part in parts:
+            for name, seconds in part.timings.items():
+                merged.timings[name] = merged.timings.get(name, 0.0) + seconds
+        if any(p.inferred is not None for p in parts):
+            merged.inferred = np.ones(num_frames, dtype=bool)
+            for part, offset in zip(parts, offsets):
+                if part.inferred is not None:
+                    merged.inferred[offset : offset + part.num_frames] = part.inferred
+        return merged
+
+    def _class_name(self, class_id):
+        if class_id < len(self.class_names):
+            return self.class_names[class_id]
+        return str(class_id)
+
+    def to_frame_lists(self):
+        """Старый формат: для каждого кадра список {"class", "confidence", "bbox"}."""
+        frames = [[] for _ in range(self.num_frames)]
+        for frame, cls_id, conf, bbox in zip(
+            self.frame_idx.tolist(),
+            self.class_id.tolist(),
+            self.conf.tolist(),
+            self.xywh.tolist(),
+        ):
+            frames[frame].append(
+                {"class": self._class_name(cls_id), "confidence": conf, "bbox": bbox}
+            )
+        return frames
+
+    def to_columns(self):
+        """Колонки как списки (для JSON)."""
+        columns = {
+            "num_frames": self.num_frames,
+            "classes": self.class_names,
+            "frame_idx": self.frame_idx.tolist(),
+            "class_id": self.class_id.tolist(),
+            "conf": self.conf.tolist(),
+            "x": self.xywh[:, 0].tolist(),
+            "y": self.xywh[:, 1].tolist(),
+            "w": self.xywh[:, 2].tolist(),
+            "h": self.xywh[:, 3].tolist(),
+        }
+        if self.inferred is not None:
+            columns["inferred"] = self.inferred.tolist()
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        xywh = np.stack(
+            [np.asarray(columns[k], dtype=np.int64) for k in ("x", "y", "w", "h")],
+            axis=1,
+        )
+        dets = cls(
+            columns["frame_idx"],
+            columns["class_id"],
+            columns["conf"],
+            xywh,
+            columns["classes"],
+            columns["num_frames"],
+        )
+        if columns.get("inferred") is not None:
+            dets.inferred = np.asarray(columns["inferred"], dtype=bool)
+        return dets
+
+    def _binary_columns(self):
+        values = {
+            "frame_idx": self.frame_idx,
+            "class_id": self.class_id,
+            "conf": self.conf,
+            "x": self.xywh[:, 0],
+            "y": self.xywh[:, 1],
+            "w": self.xywh[:, 2],
+            "h": self.xywh[:, 3],
+        }
+        return {
+            name: np.ascontiguousarray(values[name], dtype=dtype)
+            for name, dtype in COLUMN_DTYPES.items()
+        }
+
+    def to_msgpack(self, **extra):
+        """MessagePack: колонки как сырые little-endian байты. Нужен пакет msgpack."""
+        import msgpack
+
+        doc = dict(extra)
+        doc.update(
+            num_frames=self.num_frames, count=len(self), classes=self.class_names
+        )
+        doc["dtypes"] = {name: dtype.str for name, dtype in COLUMN_DTYPES.items()}
+        for name, array in self._binary_columns().items():
+            doc[name] = array.tobytes()
+        if self.inferred is not None:
+            # По байту u1 на кадр
+            doc["inferred"] = self.inferred.astype(np.uint8).tobytes()
+        return msgpack.packb(doc, use_bin_type=True)
+
+    def to_binary(self, **extra):
+        """
+        Сырой бинарный формат:
+        b"RPTD" | u32 версия | u32 длина заголовка | JSON-заголовок | колонки подряд.
+        Порядок и типы колонок перечислены в заголовке. Если есть флаги
+        inferred, они идут после колонок: по байту u1 на кадр (frame_columns).
+        """
+        header = dict(extra)
+        header.update(
+            num_frames=self.num_frames,
+            count=len(self),
+            classes=self.class_names,
+            columns=[[name, dtype.str] for name, dtype in COLUMN_DTYPES.items()],
+        )
+        if self.inferred is not None:
+            header["frame_columns"] = [["inferred", "|u1"]]
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        chunks = [
+            BINARY_MAGIC,
+            struct.pack("<II", BINARY_VERSION, len(header_bytes)),
+            header_bytes,
+        ]
+        chunks += [array.tobytes() for array in self._binary_columns().values()]
+        if self.inferred is not None:
+            chunks.append(self.inferred.astype(np.uint8).tobytes())
+        return b"".join(chunks)
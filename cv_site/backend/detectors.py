@@ -0,0 +1,54 @@
+# Общий интерфейс детекторов: каждый бэкенд реализует
+# detect_batch(frames, confidence=None, iou=None) -> ColumnarDetections —
+# один проход модели по списку кадров (numpy BGR или пути к файлам),
+# frame_idx результата — индекс кадра в frames.
+
+# Параметры инференса по умолчанию, общие для всех бэкендов
+CONFIDENCE = 0.32
+IOU = 0.5
+IMGSZ = 640
+
+# pt — PyTorch через Ultralytics (он же загружает TorchScript и OpenVINO),
+# onnx — ONNX Runtime без torch и ultralytics в процессе
+BACKENDS = ("pt", "onnx")
+
+
+def parse_backends(spec):
+    """
+    Бэкенды по моделям из строки вида "small=onnx,nano=pt".
+    :return: {имя модели: бэкенд}; :raise ValueError при неизвестном бэкенде
+    """
+    backends = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, backend = item.partition("=")
+        backend = backend.strip().lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд детектора: {item.strip()}")
+        backends[name.strip()] = backend
+    return backends
+
+
+def load_detector(backend, model_path, num_threads=0, **options):
+    """
+    Создаёт детектор бэкенда. Модули бэкендов импортируются лениво,
+    поэтому процесс, обслуживающий только ONNX, не загружает torch.
+    :param num_threads: потоков инференса (0 — по умолчанию бэкенда)
+    :param options: параметры конструктора детектора
+    """
+    if backend == "onnx":
+        from detect_onnx import ONNXDetector
+
+        if num_threads and not options.get("intra_op_threads"):
+            options["intra_op_threads"] = num_threads
+        return ONNXDetector(model_path, **options)
+    if backend == "pt":
+        from detect_pt import PTDetector
+
+        if num_threads:
+            import torch
+
+            torch.set_num_threads(num_threads)
+        return PTDetector(model_path, **options)
+    raise ValueError(f"Неизвестный бэкенд детектора: {backend}")
@@ -0,0 +1,212 @@
+import asyncio
+
+import cv2
+import numpy as np
+
+from detections import ColumnarDetections
+from postprocess import box_iou, xywh_to_xyxy
+
+# Порог доли изменения кадра (средняя абсолютная разница / 255) для нового ключевого кадра
+KEYFRAME_THRESHOLD = 0.04
+# Минимальный IoU, при котором боксы соседних ключевых кадров считаются одним объектом
+MATCH_IOU = 0.3
+
+
+class KeyframeSelector:
+    """
+    Выбирает ключевые кадры видео, на которых запускается модель.
+    Каждый кадр сравнивается с последним ключевым по уменьшенной серой
+    копии; кадр становится ключевым, если изменение больше порога
+    или с прошлого ключевого прошло max_stride кадров.
+    """
+
+    def __init__(self, max_stride=5, threshold=KEYFRAME_THRESHOLD, thumb_width=64):
+        """
+        :param max_stride: максимальный шаг между ключевыми кадрами (1 — каждый кадр)
+        :param threshold: порог изменения кадра, доля от 0 до 1
+        :param thumb_width: ширина уменьшенной копии для сравнения
+        """
+        self.max_stride = max(1, int(max_stride))
+        self.threshold = threshold
+        self.thumb_width = thumb_width
+        self._key_thumb = None
+        self._since_key = 0
+        self.keyframes = 0
+
+    def _thumb(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.thumb_width, max(1, height * self.thumb_width // max(width, 1)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def score(self, thumb):
+        """Доля изменения относительно последнего ключевого кадра (0..1)."""
+        return float(cv2.absdiff(thumb, self._key_thumb).mean()) / 255.0
+
+    def is_keyframe(self, frame):
+        if self.max_stride == 1:
+            self.keyframes += 1
+            return True
+        thumb = self._thumb(frame)
+        if (
+            self._key_thumb is None
+            or self._since_key + 1 >= self.max_stride
+            or self.score(thumb) > self.threshold
+        ):
+            self._key_thumb = thumb
+            self._since_key = 0
+            self.keyframes += 1
+            return True
+        self._since_key += 1
+        return False
+
+    def select(self, frames):
+        """:return: np.ndarray bool — какие из кадров ключевые"""
+        return np.array([self.is_keyframe(frame) for frame in frames], dtype=bool)
+
+
+def match_boxes(a_xyxy, a_cls, b_xyxy, b_cls, min_iou=MATCH_IOU):
+    """
+    Жадное сопоставление боксов двух кадров по IoU внутри одного класса.
+    :return: np.ndarray (M, 2) — пары индексов (в a, в b)
+    """
+    iou = box_iou(a_xyxy, b_xyxy)
+    iou[np.asarray(a_cls)[:, None] != np.asarray(b_cls)[None, :]] = 0.0
+    pairs = []
+    while iou.size:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < min_iou:
+            break
+        pairs.append((i, j))
+        iou[i, :] = 0.0
+        iou[:, j] = 0.0
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def interpolate_boxes(a, b, ts, min_iou=MATCH_IOU):
+    """
+    Боксы промежуточных кадров между двумя ключевыми.
+    Сопоставленные боксы линейно интерполируются; несопоставленные
+    остаются на кадрах, которые ближе к их ключевому кадру.
+    :param a: (xyxy, conf, class_id) предыдущего ключевого кадра
+    :param b: (xyxy, conf, class_id) следующего ключевого кадра
+    :param ts: доли пути от a к b для промежуточных кадров (0 < t < 1)
+    :return: (номер кадра в ts, xyxy, conf, class_id) — массивы для всех кадров сразу
+    """
+    a_xyxy, a_conf, a_cls = a
+    b_xyxy, b_conf, b_cls = b
+    ts = np.asarray(ts, dtype=np.float32)
+    pairs = match_boxes(a_xyxy, a_cls, b_xyxy, b_cls, min_iou)
+    ia, ib = pairs[:, 0], pairs[:, 1]
+    t = ts[:, None, None]
+    # (кадры, пары, 4)
+    matched_xyxy = a_xyxy[ia][None] * (1 - t) + b_xyxy[ib][None] * t
+    matched_conf = a_conf[ia][None] * (1 - ts[:, None]) + b_conf[ib][None] * ts[:, None]
+    frame = [np.repeat(np.arange(len(ts)), len(pairs))]
+    xyxy = [matched_xyxy.reshape(-1, 4)]
+    conf = [matched_conf.reshape(-1)]
+    cls = [np.tile(a_cls[ia], len(ts))]
+    for xyxy_k, conf_k, cls_k, used, near in (
+        (a_xyxy, a_conf, a_cls, ia, ts < 0.5),
+        (b_xyxy, b_conf, b_cls, ib, ts >= 0.5),
+    ):
+        rest = np.setdiff1d(np.arange(len(conf_k)), used)
+        frames = np.flatnonzero(near)
+        frame.append(np.repeat(frames, len(rest)))
+        xyxy.append(np.tile(xyxy_k[rest], (len(frames), 1)))
+        conf.append(np.tile(conf_k[rest], len(frames)))
+        cls.append(np.tile(cls_k[rest], len(frames)))
+    return (
+        np.concatenate(frame),
+        np.concatenate(xyxy).reshape(-1, 4),
+        np.concatenate(conf),
+        np.concatenate(cls),
+    )
+
+
+def _frame_boxes(dets, frame):
+    keep = dets.frame_idx == frame
+    return (
+        xywh_to_xyxy(dets.xywh[keep]),
+        dets.conf[keep],
+        dets.class_id[keep],
+    )
+
+
+def _segment(prev, key, key_idx, class_names):
+    """
+    ColumnarDetections для кадров после prev до ключевого кадра key_idx
+    включительно; frame_idx считается от первого кадра сегмента.
+    """
+    prev_idx, prev_boxes = prev if prev is not None else (key_idx - 1, None)
+    gap = key_idx - prev_idx - 1
+    frame, xyxy, conf, cls = [], [], [], []
+    if gap and prev_boxes is not None:
+        ts = np.arange(1, gap + 1, dtype=np.float32) / (gap + 1)
+        frame_i, xyxy_i, conf_i, cls_i = interpolate_boxes(prev_boxes, key, ts)
+        frame, xyxy, conf, cls = [frame_i], [xyxy_i], [conf_i], [cls_i]
+    frame.append(np.full(len(key[1]), gap))
+    xyxy.append(key[0])
+    conf.append(key[1])
+    cls.append(key[2])
+    inferred = np.zeros(gap + 1, dtype=bool)
+    inferred[-1] = True
+    dets = ColumnarDetections.from_xyxy(
+        np.concatenate(frame),
+        np.concatenate(cls),
+        np.concatenate(conf),
+        np.concatenate(xyxy),
+        class_names,
+        gap + 1,
+    )
+    dets.inferred = inferred
+    return prev_idx + 1, dets
+
+
+def _hold(prev, last_idx, class_names):
+    """Кадры после последнего ключевого: следующего нет, боксы повторяются."""
+    prev_idx, (xyxy, conf, cls) = prev
+    count = last_idx - prev_idx
+    dets = ColumnarDetections.from_xyxy(
+        np.repeat(np.arange(count), len(conf)),
+        np.tile(cls, count),
+        np.tile(conf, count),
+        np.tile(xyxy, (count, 1)),
+        class_names,
+        count,
+    )
+    dets.inferred = np.zeros(count, dtype=bool)
+    return prev_idx + 1, dets
+
+
+async def detect_keyframes(pipeline, predict_batch, selector):
+    """
+    Детекции видео с адаптивным шагом: модель запускается только на
+    ключевых кадрах, боксы остальных кадров интерполируются между
+    соседними ключевыми.
+    :param pipeline: VideoFramePipeline
+    :param predict_batch: async-функция (frames) -> ColumnarDetections
+    :param selector: KeyframeSelector
+    :yield: (индекс первого кадра, ColumnarDetections подряд идущих кадров);
+        у детекций заполнено inferred — где работала модель
+    """
+
+    async def predict_keyframes(frames):
+        # resize, cvtColor и absdiff на каждом кадре — вне event loop
+        mask = await asyncio.to_thread(selector.select, frames)
+        keys = [frame for frame, is_key in zip(frames, mask) if is_key]
+        return mask, (await predict_batch(keys) if keys else None)
+
+    prev = None  # (индекс, боксы) последнего ключевого кадра
+    class_names = []
+    async for first_idx, (mask, dets) in pipeline.detect_batches(predict_keyframes):
+        if dets is None:
+            continue
+        class_names = dets.class_names
+        for k, offset in enumerate(np.flatnonzero(mask)):
+            key_idx = first_idx + int(offset)
+            key = _frame_boxes(dets, k)
+            yield _segment(prev, key, key_idx, class_names)
+            prev = (key_idx, key)
+    if prev is not None and pipeline.frames_done - 1 > prev[0]:
+        yield _hold(prev, pipeline.frames_done - 1, class_names)
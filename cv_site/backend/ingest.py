@@ -0,0 +1,268 @@
+import hashlib
+import os
+import re
+from collections import namedtuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+CHUNK_SIZE = 1024 * 1024
+# Сколько байт начала файла нужно для проверки сигнатуры
+HEADER_SIZE = 16
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UploadSignatureError(Exception):
+    pass
+
+
+def _is_iso_media(head):
+    # mp4/mov: размер атома (4 байта), затем его тип
+    return head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip")
+
+
+# Сигнатуры (magic bytes) по расширению
+SIGNATURES = {
+    "jpg": lambda head: head.startswith(b"\xff\xd8\xff"),
+    "jpeg": lambda head: head.startswith(b"\xff\xd8\xff"),
+    "png": lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"),
+    "mp4": _is_iso_media,
+    "mov": _is_iso_media,
+    "avi": lambda head: head[:4] == b"RIFF" and head[8:12] == b"AVI ",
+    "mkv": lambda head: head.startswith(b"\x1a\x45\xdf\xa3"),
+}
+
+IngestedUpload = namedtuple("IngestedUpload", "path data size sha256")
+
+
+def check_signature(head, ext):
+    check = SIGNATURES.get(ext)
+    return check is None or check(head)
+
+
+def ingest_upload(fileobj, ext, max_bytes, dest=None, chunk_size=CHUNK_SIZE):
+    """
+    Читает загрузку кусками за один проход: сигнатура проверяется по первому
+    куску до записи в dest, sha256 и размер считаются на лету, чтение
+    прерывается, как только размер превысил max_bytes.
+    UploadFile попадает сюда, когда Starlette уже принял часть multipart
+    целиком во временный файл, поэтому ранний отказ по сигнатуре делает
+    UploadSignatureMiddleware — ещё при приёме тела.
+    :param fileobj: файловый объект загрузки (UploadFile.file)
+    :param dest: куда записать файл; None — собрать байты в памяти
+    :return: IngestedUpload(path, data, size, sha256); data — None при записи в dest
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    head = fileobj.read(max(chunk_size, HEADER_SIZE))
+    if not check_signature(head[:HEADER_SIZE], ext):
+        raise UploadSignatureError(ext)
+    chunks = []
+    out = open(dest, "wb") if dest else None
+    try:
+        chunk = head
+        while chunk:
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(size)
+            hasher.update(chunk)
+            if out is not None:
+                out.write(chunk)
+            else:
+                chunks.append(chunk)
+            chunk = fileobj.read(chunk_size)
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(dest)
+        raise
+    if out is not None:
+        out.close()
+    data = None if out is not None else b"".join(chunks)
+    return IngestedUpload(dest, data, size, hasher.hexdigest())
+
+
+class _BodyRejected(HTTPException):
+    """Отказ, поднятый middleware при приёме тела запроса."""
+
+
+class _ReceiveCheckMiddleware:
+    """
+    Базовый ASGI middleware: проверяет тело запроса по мере приёма.
+    Проверка поднимает _BodyRejected, приём тела прерывается, клиент
+    получает ошибку, если ответ ещё не начат.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def checker(self, scope):
+        """
+        :return: функция (сообщение http.request) -> None, поднимающая
+            _BodyRejected, или None, если запрос проверять не нужно
+        """
+        raise NotImplementedError
+
+    async def __call__(self, scope, receive, send):
+        check = self.checker(scope) if scope["type"] == "http" else None
+        if check is None:
+            await self.app(scope, receive, send)
+            return
+        started = False
+
+        async def checked_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                # FastAPI пробрасывает HTTPException из чтения тела как есть
+                check(message)
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, checked_receive, tracked_send)
+        except _BodyRejected as exc:
+            if started:
+                raise
+            await self._reject(scope, receive, send, exc.status_code, exc.detail)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code, detail):
+        response = JSONResponse({"detail": detail}, status_code=status_code)
+        await response(scope, receive, send)
+
+
+class BodySizeLimitMiddleware(_ReceiveCheckMiddleware):
+    """
+    ASGI middleware: отклоняет запрос с телом больше max_bytes кодом 413.
+    По Content-Length — до чтения тела, без него — как только принятые
+    байты превысили лимит, так что большая загрузка не попадает на диск
+    целиком даже во временный файл multipart-парсера.
+    """
+
+    def __init__(self, app, max_bytes, detail="Слишком большой запрос."):
+        super().__init__(app)
+        self.max_bytes = max_bytes
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            length = dict(scope["headers"]).get(b"content-length")
+            try:
+                too_large = length is not None and int(length) > self.max_bytes
+            except ValueError:
+                too_large = False
+            if too_large:
+                await self._reject(scope, receive, send, 413, self.detail)
+                return
+        await super().__call__(scope, receive, send)
+
+    def checker(self, scope):
+        received = 0
+
+        def check(message):
+            nonlocal received
+            received += len(message.get("body", b""))
+            if received > self.max_bytes:
+                raise _BodyRejected(status_code=413, detail=self.detail)
+
+        return check
+
+
+class MultipartSniffer:
+    """
+    Потоковая проверка сигнатуры первого файла в теле multipart/form-data:
+    куски тела подаются по мере приёма, решение принимается, как только
+    пришли первые HEADER_SIZE байт файла.
+    """
+
+    def __init__(self, boundary, limit=64 * 1024):
+        """
+        :param boundary: граница частей из заголовка Content-Type
+        :param limit: сколько байт начала тела просматривать; если файл
+            не начался раньше, проверка остаётся за ingest_upload
+        """
+        self.delimiter = b"--" + boundary
+        self.limit = limit
+        self.ext = None
+        self._buffer = b""
+        self.result = None  # None — ещё неизвестно, True/False — решение
+
+    def feed(self, chunk):
+        """:return: True/False, если решение принято, иначе None"""
+        if self.result is not None:
+            return self.result
+        self._buffer += chunk
+        self.result = self._scan()
+        if self.result is None and len(self._buffer) > self.limit:
+            self.result = True
+        if self.result is not None:
+            self._buffer = b""
+        return self.result
+
+    def _scan(self):
+        buf = self._buffer
+        pos = 0
+        while True:
+            start = buf.find(self.delimiter, pos)
+            if start == -1:
+                return None
+            headers_start = start + len(self.delimiter)
+            if buf[headers_start : headers_start + 2] == b"--":
+                return True  # конец тела, файлов нет
+            headers_end = buf.find(b"\r\n\r\n", headers_start)
+            if headers_end == -1:
+                return None
+            content = headers_end + 4
+            match = re.search(rb'filename="([^"]*)"', buf[headers_start:headers_end])
+            if match is None:
+                pos = content  # обычное поле формы
+                continue
+            name = match.group(1).decode("utf-8", "replace")
+            self.ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+            end = buf.find(b"\r\n" + self.delimiter, content)
+            if end != -1:
+                head = buf[content : min(end, content + HEADER_SIZE)]
+            elif len(buf) - content >= HEADER_SIZE + len(self.delimiter) + 2:
+                # Граница внутри первых HEADER_SIZE байт уже нашлась бы
+                head = buf[content : content + HEADER_SIZE]
+            else:
+                return None
+            return check_signature(head, self.ext)
+
+
+class UploadSignatureMiddleware(_ReceiveCheckMiddleware):
+    """
+    ASGI middleware: отклоняет загрузку multipart/form-data кодом 400, если
+    начало файла не совпадает с сигнатурой его расширения. Проверка идёт
+    по принимаемому телу, так что файл с чужим содержимым отклоняется
+    после первых килобайт, а не после приёма всего тела во временный файл.
+    """
+
+    def __init__(self, app, detail="Содержимое файла не соответствует расширению"):
+        super().__init__(app)
+        self.detail = detail
+
+    def checker(self, scope):
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        if not content_type.lower().startswith(b"multipart/form-data"):
+            return None
+        match = re.search(rb'boundary="?([^";]+)"?', content_type)
+        if match is None:
+            return None
+        sniffer = MultipartSniffer(match.group(1))
+
+        def check(message):
+            if sniffer.feed(message.get("body", b"")) is False:
+                raise _BodyRejected(
+                    status_code=400, detail=f"{self.detail} .{sniffer.ext}."
+                )
+
+        return check
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class DiskQuotaManager:
+    """
+    Квоты на размер каталогов (uploads/, outputs/) внутри процесса бэкенда.
+    Держит в памяти индекс файлов (размер, mtime, последнее обращение),
+    поэтому вытеснение не обходит каталог: при превышении квоты удаляются
+    файлы, к которым дольше всего не обращались. Полный обход каталога
+    выполняется только при старте и изредка для сверки с диском.
+    """
+
+    def __init__(self, quotas, max_age=None, interval=60.0, rescan_interval=600.0):
+        """
+        :param quotas: {каталог: квота в байтах} (0 — без ограничения)
+        :param max_age: удалять файлы старше max_age секунд (None — не удалять)
+        :param interval: период фоновой проверки, секунды
+        :param rescan_interval: период сверки индекса с диском, секунды
+        """
+        self.quotas = {os.path.normpath(d): q for d, q in quotas.items()}
+        self.max_age = max_age
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        # каталог -> OrderedDict(путь -> [размер, mtime, atime]), от давних обращений к свежим
+        self._index = {d: OrderedDict() for d in self.quotas}
+        self._sizes = dict.fromkeys(self.quotas, 0)
+        self._held = set()  # файлы, которые сейчас нельзя удалять
+        self._lock = threading.Lock()
+        self._task = None
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        for directory in self.quotas:
+            os.makedirs(directory, exist_ok=True)
+            self.scan(directory)
+
+    def _directory(self, path):
+        directory = os.path.dirname(os.path.normpath(path))
+        return directory if directory in self._index else None
+
+    def scan(self, directory):
+        """Перестраивает индекс каталога по содержимому диска."""
+        with self._lock:
+            known = {path: item[2] for path, item in self._index[directory].items()}
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                # Обращения, отмеченные через touch(), не теряются при сверке
+                last_access = max(
+                    stat.st_atime,
+                    stat.st_mtime,
+                    known.get(os.path.normpath(entry.path), 0),
+                )
+                entries.append((last_access, entry.path, stat.st_size, stat.st_mtime))
+        index = OrderedDict()
+        for last_access, path, size, mtime in sorted(entries):
+            index[os.path.normpath(path)] = [size, mtime, last_access]
+        with self._lock:
+            self._index[directory] = index
+            self._sizes[directory] = sum(item[0] for item in index.values())
+            self._held = {
+                path
+                for path in self._held
+                if self._directory(path) != directory or path in index
+            }
+
+    def add(self, path):
+        """Учитывает новый или изменённый файл и сразу проверяет квоту каталога."""
+        directory = self._directory(path)
+        if directory is None:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        path = os.path.normpath(path)
+        with self._lock:
+            index = self._index[directory]
+            old = index.pop(path, None)
+            if old is not None:
+                self._sizes[directory] -= old[0]
+            index[path] = [stat.st_size, stat.st_mtime, time.time()]
+            self._sizes[directory] += stat.st_size
+        self._evict_over_quota(directory)
+
+    def touch(self, path):
+        """Отмечает обращение к файлу: он уходит в конец очереди на вытеснение."""
+        directory = self._directory(path)
+        if directory is None:
+            return
+        path = os.path.normpath(path)
+        with self._lock:
+            item = self._index[directory].get(path)
+            if item is not None:
+                item[2] = time.time()
+                self._index[directory].move_to_end(path)
+
+    def remove(self, path):
+        """Удаляет файл (например, временную загрузку) и его запись в индексе."""
+        directory = self._directory(path)
+        path = os.path.normpath(path)
+        if directory is not None:
+            with self._lock:
+                item = self._index[directory].pop(path, None)
+                if item is not None:
+                    self._sizes[directory] -= item[0]
+                self._held.discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def hold(self, path):
+        """Защищает файл от вытеснения, пока он нужен (например, ждёт в очереди)."""
+        with self._lock:
+            self._held.add(os.path.normpath(path))
+
+    def release(self, path):
+        with self._lock:
+            self._held.discard(os.path.normpath(path))
+
+    def usage(self):
+        """Занятое место по каталогам, байты."""
+        with self._lock:
+            return dict(self._sizes)
+
+    def enforce(self):
+        """Удаляет устаревшие файлы и вытесняет лишнее во всех каталогах."""
+        for directory in self._index:
+            if self.max_age:
+                self._expire(directory, time.time() - self.max_age)
+            self._evict_over_quota(directory)
+
+    def _expire(self, directory, deadline):
+        with self._lock:
+            expired = [
+                path
+                for path, (_, mtime, last_access) in self._index[directory].items()
+                if max(mtime, last_access) < deadline and path not in self._held
+            ]
+        for path in expired:
+            self._evict(directory, path)
+
+    def _evict_over_quota(self, directory):
+        quota = self.quotas[directory]
+        if not quota:
+            return
+        while True:
+            with self._lock:
+                if self._sizes[directory] <= quota:
+                    return
+                path = next(
+                    (p for p in self._index[directory] if p not in self._held), None
+                )
+            if path is None:
+                return
+            self._evict(directory, path)
+
+    def _evict(self, directory, path):
+        with self._lock:
+            item = self._index[directory].pop(path, None)
+            if item is None:
+                return
+            self._sizes[directory] -= item[0]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.evicted_files += 1
+        self.evicted_bytes += item[0]
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        last_scan = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if time.monotonic() - last_scan >= self.rescan_interval:
+                    last_scan = time.monotonic()
+                    for directory in self._index:
+                        await asyncio.to_thread(self.scan, directory)
+                await asyncio.to_thread(self.enforce)
+            except Exception as e:
+                print(f"Ошибка очистки диска: {e}")
@@ -10,16 +10,56 @@ from fastapi import (
     Security,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from detect_onnx import ONNXDetector
-from detect_pt import PTDetector
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from detectors import BACKENDS, CONFIDENCE, IMGSZ, IOU, load_detector, parse_backends
+from batching import MicroBatcher
+from utils import decode_image
+from video_pipeline import VideoFramePipeline
+from frame_skip import KeyframeSelector, detect_keyframes
+from tiling import TILE_OVERLAP, make_tiles, merge_tiles, tile_grid
+from worker_pool import InferenceWorkerPool, PoolBusyError
+from video_jobs import DONE, QueueFullError, VideoJobQueue, VideoJobStore
+from result_cache import ResultCache
+from model_registry import ModelRegistry, load_manifest
+from rate_limit import TokenBucketLimiter, make_backend
+from detections import ColumnarDetections
+from ingest import (
+    BodySizeLimitMiddleware,
+    UploadSignatureError,
+    UploadSignatureMiddleware,
+    UploadTooLargeError,
+    ingest_upload,
+)
+from janitor import DiskQuotaManager
+from metrics import (
+    CACHE_REQUESTS,
+    DISK_BYTES,
+    DISK_EVICTED,
+    FRAMES,
+    IN_FLIGHT,
+    QUEUE_DEPTH,
+    RATE_LIMITED,
+    REGISTRY,
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    stage,
+)
+import asyncio
+import json
+import logging
 import shutil
+import time
 import uuid
 import os
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
 import cv2
-import time
-from collections import defaultdict
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 # from jose import jwt, JWTError
@@ -28,6 +68,8 @@ import requests
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 API_AUDIENCE = os.getenv("API_AUDIENCE")
 ALGORITHMS = ["RS256"]
@@ -71,23 +113,40 @@ security = HTTPBearer()
 #         raise HTTPException(401, detail="Invalid token")
 
 
-# --- Rate limiting (in-memory, для демонстрации) ---
+# --- Rate limiting (token bucket) ---
 RATE_LIMIT = 30  # запросов
 RATE_PERIOD = 60  # секунд
-client_requests = defaultdict(list)
+# memory — в пределах процесса; shm — общий для всех воркеров uvicorn на машине;
+# redis — общий для нескольких машин (нужен REDIS_URL и пакет redis)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMITER = TokenBucketLimiter(
+    make_backend(RATE_LIMIT_BACKEND, os.getenv("REDIS_URL")),
+    RATE_LIMIT,
+    RATE_PERIOD,
+)
 
 
 def check_rate_limit(request: Request):
-    ip = request.client.host
-    now = time.time()
-    client_requests[ip] = [t for t in client_requests[ip] if now - t < RATE_PERIOD]
-    if len(client_requests[ip]) >= RATE_LIMIT:
+    if not RATE_LIMITER.allow(request.client.host):
+        RATE_LIMITED.inc(endpoint=request.url.path)
         raise HTTPException(429, detail="Слишком много запросов. Попробуйте позже.")
-    client_requests[ip].append(now)
 
 
+# --- Ограничение размера загрузок ---
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", 50))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Запас на заголовки multipart и поля формы сверх размера самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+
 # --- CORS ---
 app = FastAPI()
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    detail=f"Размер файла превышает {MAX_UPLOAD_MB} МБ.",
+)
+# Файл с чужим содержимым отклоняется по первым байтам, до приёма всего тела
+app.add_middleware(UploadSignatureMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -99,12 +158,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+ROUTE_PATHS = None
+
+
+def endpoint_label(path):
+    """Метка эндпоинта для метрик: шаблон маршрута, а не конкретный путь."""
+    # POST /jobs/video — отдельный маршрут, не опрос статуса /jobs/{job_id}
+    if path == "/jobs/video":
+        return path
+    if path.startswith("/jobs/"):
+        if path.endswith("/result"):
+            return "/jobs/{job_id}/result"
+        return "/jobs/{job_id}"
+    if path.startswith("/outputs/"):
+        return "/outputs"
+    global ROUTE_PATHS
+    if ROUTE_PATHS is None:
+        ROUTE_PATHS = {getattr(route, "path", None) for route in app.routes}
+    return path if path in ROUTE_PATHS else "other"
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    endpoint = endpoint_label(request.url.path)
+    IN_FLIGHT.inc(endpoint=endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start, endpoint=endpoint, status=status
+        )
+
+
 # Создаём папки, если их нет
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("outputs", exist_ok=True)
+os.makedirs("jobs", exist_ok=True)
 
 app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
 
+# --- Квоты на диск для uploads/ и outputs/ ---
+JANITOR = DiskQuotaManager(
+    {
+        "uploads": int(os.getenv("UPLOADS_QUOTA_MB", 1024)) * 1024 * 1024,
+        "outputs": int(os.getenv("OUTPUTS_QUOTA_MB", 4096)) * 1024 * 1024,
+    },
+    max_age=float(os.getenv("FILE_MAX_AGE_HOURS", 24)) * 3600 or None,
+    interval=float(os.getenv("JANITOR_INTERVAL_SEC", 60)),
+)
+for _directory in JANITOR.quotas:
+    DISK_BYTES.set_function(
+        lambda d=_directory: JANITOR.usage()[d], directory=_directory
+    )
+DISK_EVICTED.set_function(lambda: JANITOR.evicted_files)
+
+
+@app.on_event("startup")
+async def start_janitor():
+    JANITOR.start()
+
+
+@app.on_event("shutdown")
+async def stop_janitor():
+    await JANITOR.stop()
+
+
+@app.middleware("http")
+async def touch_outputs(request: Request, call_next):
+    # Отдача файла из outputs/ продлевает ему жизнь при вытеснении по LRU
+    if request.url.path.startswith("/outputs/"):
+        JANITOR.touch(os.path.join("outputs", os.path.basename(request.url.path)))
+    return await call_next(request)
+
 # Маппинг моделей (заглушка)
 MODEL_PATHS = {
     "nano": "models/model_nano.pt",
@@ -113,39 +243,293 @@ MODEL_PATHS = {
     "large": "models/model_large.pt",
 }
 
+# Манифест cv_pipeline/scripts/export_benchmark.py: самый быстрый на этой
+# машине артефакт каждой модели (ONNX, TorchScript или OpenVINO)
+MODEL_MANIFEST = os.getenv("MODEL_MANIFEST", "")
+MODEL_ARTIFACTS = load_manifest(MODEL_MANIFEST, MODEL_PATHS) if MODEL_MANIFEST else {}
+
+# --- Бэкенд детектора: pt (PyTorch/Ultralytics) или onnx (ONNX Runtime) ---
+# MODEL_BACKENDS ("small=onnx,nano=pt") важнее манифеста, манифест — MODEL_BACKEND
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "pt").lower()
+MODEL_BACKENDS = parse_backends(os.getenv("MODEL_BACKENDS", ""))
+if MODEL_BACKEND not in BACKENDS:
+    raise ValueError(f"Неизвестный бэкенд детектора: {MODEL_BACKEND}")
+PT_DEVICE = os.getenv("PT_DEVICE", "cuda")
+ONNX_OPTIONS = {
+    "sessions": int(os.getenv("ONNX_SESSIONS", 1)),
+    "intra_op_threads": int(os.getenv("ONNX_INTRA_OP_THREADS", 0)),
+    "inter_op_threads": int(os.getenv("ONNX_INTER_OP_THREADS", 0)),
+}
+if os.getenv("ONNX_GRAPH_OPTIMIZATION"):
+    ONNX_OPTIONS["graph_optimization"] = os.getenv("ONNX_GRAPH_OPTIMIZATION")
+
+# {имя модели: (бэкенд, путь, параметры конструктора детектора)}
+MODEL_SPECS = {}
+for _name, _path in MODEL_PATHS.items():
+    _artifact = MODEL_ARTIFACTS.get(_name)
+    if _artifact is not None:
+        # TorchScript и OpenVINO загружает Ultralytics, т.е. бэкенд pt
+        _backend = "onnx" if _artifact["backend"] == "onnx" else "pt"
+        _path = _artifact["path"]
+    else:
+        _backend = MODEL_BACKEND
+    _backend = MODEL_BACKENDS.get(_name, _backend)
+    if _backend == "onnx":
+        if _path.endswith(".pt"):
+            _path = _path[: -len(".pt")] + ".onnx"
+        _options = dict(ONNX_OPTIONS)
+        if _artifact is not None and _artifact["backend"] == "onnx":
+            # Уровень оптимизации графа, замеренный самым быстрым на этой машине
+            _options.update(_artifact.get("options", {}))
+    else:
+        _options = {"device": PT_DEVICE}
+    MODEL_PATHS[_name] = _path
+    MODEL_SPECS[_name] = (_backend, _path, _options)
+    logger.info("Модель %s: %s %s", _name, _backend, _path)
+
 SUPPORTED_IMAGE_EXTS = {"jpg", "jpeg", "png"}
 SUPPORTED_VIDEO_EXTS = {"mp4", "avi", "mov", "mkv"}
 
-# Инициализация PTDetector один раз при запуске
-PT_MODELS = {
-    "small": PTDetector("models/model_5783f.pt"),
-    # Можно добавить другие модели, если потребуется
+# Модели загружаются при первом запросе и выгружаются по LRU при превышении бюджета
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 2048))
+MODEL_REGISTRY = ModelRegistry(
+    MODEL_PATHS,
+    lambda name, path: load_detector(
+        MODEL_SPECS[name][0], path, **MODEL_SPECS[name][2]
+    ),
+    memory_budget_bytes=MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+)
+
+# --- Пул процессов инференса (0 — инференс в потоках главного процесса) ---
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 0))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", 16))
+INFERENCE_SHM_SLOT_MB = int(os.getenv("INFERENCE_SHM_SLOT_MB", 64))
+
+INFERENCE_POOL = None
+if INFERENCE_WORKERS > 0:
+    INFERENCE_POOL = InferenceWorkerPool(
+        MODEL_SPECS,
+        num_workers=INFERENCE_WORKERS,
+        queue_size=INFERENCE_QUEUE_SIZE,
+        slot_bytes=INFERENCE_SHM_SLOT_MB * 1024 * 1024,
+        memory_budget=MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+    )
+
+
+@app.on_event("startup")
+async def start_inference_pool():
+    if INFERENCE_POOL is not None:
+        INFERENCE_POOL.start()
+
+
+@app.on_event("shutdown")
+async def stop_inference_pool():
+    if INFERENCE_POOL is not None:
+        INFERENCE_POOL.stop()
+
+
+async def run_inference(
+    model, frames, confidence, iou, endpoint="", count_frames=True
+):
+    """
+    Инференс батча кадров без блокировки event loop: в пуле процессов,
+    если он включён, иначе в отдельном потоке.
+    :param count_frames: учитывать ли кадры в метрике (False для тайлов)
+    :return: ColumnarDetections, frame_idx — индекс кадра в frames
+    """
+    start = time.perf_counter()
+    if INFERENCE_POOL is not None:
+        dets = await INFERENCE_POOL.submit(model, frames, confidence, iou)
+    else:
+
+        def predict():
+            # Загрузка модели (если нужна) тоже блокирующая — делаем её в потоке
+            return MODEL_REGISTRY.get(model).detect_batch(frames, confidence, iou)
+
+        dets = await asyncio.to_thread(predict)
+    # inference — с ожиданием очереди и потока, predict/postprocess — внутри детектора
+    STAGE_SECONDS.observe(
+        time.perf_counter() - start, stage="inference", endpoint=endpoint, model=model
+    )
+    for name, seconds in dets.timings.items():
+        STAGE_SECONDS.observe(seconds, stage=name, endpoint=endpoint, model=model)
+    if count_frames:
+        FRAMES.inc(len(frames), endpoint=endpoint, model=model)
+    return dets
+
+
+# --- Тайлинг кадров высокого разрешения ---
+# Сколько тайлов отдавать модели за один forward pass
+TILE_MAX_BATCH = int(os.getenv("TILE_MAX_BATCH", 16))
+TILE_MIN_SIZE = 160
+TILE_MAX_SIZE = 4096
+
+
+def check_tiling(tile_size, tile_overlap):
+    """tile_size=0 — тайлинг выключен."""
+    if tile_size and not TILE_MIN_SIZE <= tile_size <= TILE_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"tile_size должен быть 0 или от {TILE_MIN_SIZE} до {TILE_MAX_SIZE}.",
+        )
+    if not 0 <= tile_overlap < 0.5:
+        raise HTTPException(
+            status_code=400, detail="tile_overlap должен быть от 0 до 0.5."
+        )
+
+
+async def run_tiled_inference(
+    model, frames, confidence, iou, endpoint, tile_size, tile_overlap
+):
+    """
+    Инференс по перекрывающимся тайлам: тайлы всех кадров идут в модель
+    батчами по TILE_MAX_BATCH, боксы склеиваются NMS в координатах кадра.
+    :return: ColumnarDetections, frame_idx — индекс кадра в frames
+    """
+    start = time.perf_counter()
+    tiles, tile_frame, offsets = make_tiles(frames, tile_size, tile_overlap)
+    tile_time = time.perf_counter() - start
+    STAGE_SECONDS.observe(tile_time, stage="tile", endpoint=endpoint, model=model)
+    parts = []
+    for first in range(0, len(tiles), TILE_MAX_BATCH):
+        parts.append(
+            await run_inference(
+                model,
+                tiles[first : first + TILE_MAX_BATCH],
+                confidence,
+                iou,
+                endpoint,
+                count_frames=False,
+            )
+        )
+    dets = merge_tiles(
+        ColumnarDetections.concat(parts), tile_frame, offsets, len(frames), iou
+    )
+    dets.timings["tile"] = tile_time
+    STAGE_SECONDS.observe(
+        dets.timings["merge"], stage="merge", endpoint=endpoint, model=model
+    )
+    FRAMES.inc(len(frames), endpoint=endpoint, model=model)
+    return dets
+
+
+# --- Micro-batching для /infer-image ---
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 10))
+
+
+async def run_image_batch(key, frames):
+    model, confidence, iou = key
+    dets = await run_inference(model, frames, confidence, iou, "/infer-image")
+    return dets.to_frame_lists()
+
+
+IMAGE_BATCHER = MicroBatcher(
+    run_image_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait=BATCH_MAX_WAIT_MS / 1000,
+)
+
+QUEUE_DEPTH.set_function(lambda: IMAGE_BATCHER.queue_depth, queue="image_batcher")
+QUEUE_DEPTH.set_function(
+    lambda: INFERENCE_POOL.queue_depth if INFERENCE_POOL else 0,
+    queue="inference_pool",
+)
+
+# --- Видео: кадры идут в модель батчами прямо из памяти ---
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", 8))
+# 0 — без ограничения; по умолчанию ~10 сек при 30 fps
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", 300))
+# Адаптивный шаг: модель только на ключевых кадрах, остальные интерполируются.
+# 1 — модель на каждом кадре
+VIDEO_MAX_STRIDE = int(os.getenv("VIDEO_MAX_STRIDE", 1))
+VIDEO_MAX_STRIDE_LIMIT = 30
+KEYFRAME_THRESHOLD = float(os.getenv("KEYFRAME_THRESHOLD", 0.04))
+
+# Компактные форматы ответа /infer-video, выбираются по заголовку Accept
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.raptor.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
 }
 
-# Заглушка: классы и bbox
-DEMO_DETECTIONS = [
-    {"class": "tank", "confidence": 0.92, "bbox": [100, 120, 80, 60]},
-    {"class": "apc", "confidence": 0.85, "bbox": [200, 220, 60, 40]},
-]
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "workers": INFERENCE_WORKERS,
+        "queue_depth": INFERENCE_POOL.queue_depth if INFERENCE_POOL else 0,
+        "models_loaded": MODEL_REGISTRY.loaded(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# --- Кэш результатов по содержимому загрузки ---
+RESULT_CACHE = ResultCache(
+    "cache",
+    memory_items=int(os.getenv("RESULT_CACHE_ITEMS", 256)),
+    disk_bytes=int(os.getenv("RESULT_CACHE_DISK_MB", 512)) * 1024 * 1024,
+)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
-def filter_boxes_by_confidence(boxes, confidence):
+def model_fingerprint(model):
     """
-    Фильтрует боксы по порогу confidence (best practice для postprocess).
-    :param boxes: Boxes object (ultralytics)
-    :param confidence: float, threshold
-    :return: индексы подходящих боксов
+    Бэкенд, путь и версия весов модели для ключа кэша: кэш на диске
+    переживает перезапуск, а переобученные веса по тому же пути, смена
+    бэкенда или манифеста не должны отдавать старые детекции.
     """
-    import torch
+    backend, path, _ = MODEL_SPECS[model]
+    try:
+        stat = os.stat(path)
+        version = f"{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        version = None
+    return f"{backend}:{os.path.abspath(path)}:{version}"
 
-    if hasattr(boxes, "conf"):
-        confs = boxes.conf
-        if isinstance(confs, torch.Tensor):
-            indices = (confs >= confidence).nonzero(as_tuple=True)[0].tolist()
-        else:
-            indices = [i for i, c in enumerate(confs) if c >= confidence]
-        return indices
-    return list(range(len(boxes)))
+
+async def receive_upload(file, ext, dest=None):
+    """
+    Потоковый приём загрузки с проверкой размера и сигнатуры. Чтение,
+    sha256 и запись (до MAX_UPLOAD_MB) — в потоке, не блокируя event loop.
+    :param dest: путь для записи; None — байты в памяти
+    :return: IngestedUpload(path, data, size, sha256)
+    """
+    try:
+        return await asyncio.to_thread(
+            ingest_upload, file.file, ext, MAX_UPLOAD_BYTES, dest, UPLOAD_CHUNK_SIZE
+        )
+    except UploadTooLargeError:
+        raise HTTPException(
+            status_code=413, detail=f"Размер файла превышает {MAX_UPLOAD_MB} МБ."
+        )
+    except UploadSignatureError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Содержимое файла не соответствует расширению .{ext}.",
+        )
+
+
+def write_file(path, data):
+    with open(path, "wb") as out:
+        out.write(data)
+
+
+# Заглушка: классы и bbox
+DEMO_DETECTIONS = [
+    {"class": "tank", "confidence": 0.92, "bbox": [100, 120, 80, 60]},
+    {"class": "apc", "confidence": 0.85, "bbox": [200, 220, 60, 40]},
+]
 
 
 # Старый эндпоинт для совместимости
@@ -160,18 +544,9 @@ async def predict(request: Request, file: UploadFile = File(...)):
     if ext not in SUPPORTED_IMAGE_EXTS and ext not in SUPPORTED_VIDEO_EXTS:
         raise HTTPException(status_code=400, detail=f"Формат .{ext} не поддерживается.")
 
-    file.file.seek(0, os.SEEK_END)
-    file_size = file.file.tell()
-    file.file.seek(0)
-    if file_size > 50 * 1024 * 1024:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Размер файла превышает 50 МБ.",
-        )
-
     filename = f"uploads/{uuid.uuid4()}.{ext}"
-    with open(filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await receive_upload(file, ext, filename)
+    JANITOR.add(filename)
 
     # Проверка содержимого файла
     try:
@@ -184,11 +559,14 @@ async def predict(request: Request, file: UploadFile = File(...)):
                 raise Exception("Некорректный видеофайл")
             cap.release()
     except Exception:
-        os.remove(filename)
+        JANITOR.remove(filename)
         raise HTTPException(400, detail="Некорректный или повреждённый файл.")
 
     output_path = f"outputs/{uuid.uuid4()}.{ext}"
-    shutil.copyfile(filename, output_path)
+    await asyncio.to_thread(shutil.copyfile, filename, output_path)
+    JANITOR.add(output_path)
+    # Загрузка больше не нужна: результат — копия в outputs
+    JANITOR.remove(filename)
 
     return {"output_path": output_path}
 
@@ -199,6 +577,11 @@ async def infer_image(
     request: Request,
     file: UploadFile = File(...),
     model: str = Form("small"),
+    confidence: float = Form(CONFIDENCE),
+    iou: float = Form(IOU),
+    save_output: bool = Form(True),
+    tile_size: int = Form(0),
+    tile_overlap: float = Form(TILE_OVERLAP),
 ):
     check_rate_limit(request)
     ext = file.filename.split(".")[-1].lower() if "." in file.filename else ""
@@ -206,55 +589,123 @@ async def infer_image(
         raise HTTPException(
             status_code=400, detail="Только изображения поддерживаются."
         )
-    if model not in PT_MODELS:
+    check_tiling(tile_size, tile_overlap)
+    if model not in MODEL_REGISTRY:
         raise HTTPException(status_code=400, detail="Модель не поддерживается.")
-    filename = f"uploads/{uuid.uuid4()}.{ext}"
-    with open(filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    # Проверка содержимого файла
-    try:
-        img = Image.open(filename)
-        img.verify()
-    except Exception:
-        os.remove(filename)
-        raise HTTPException(
-            400, detail="Некорректный или повреждённый файл изображения."
-        )
-    output_path = f"outputs/{uuid.uuid4()}.{ext}"
-    detector = PT_MODELS[model]
-    try:
-        results = detector.model.predict(
-            source=filename,
-            conf=detector.confidence,
-            iou=detector.iou,
-            device=detector.device,
-        )
-        shutil.copyfile(filename, output_path)
-        dets = []
-        boxes = results[0].boxes
-        names = detector.model.names
-        indices = filter_boxes_by_confidence(boxes, detector.confidence)
-        for i in indices:
-            xyxy = boxes.xyxy[i].tolist()
-            conf = float(boxes.conf[i])
-            cls_idx = int(boxes.cls[i])
-            class_name = names[cls_idx] if cls_idx < len(names) else str(cls_idx)
-            x, y, w, h = (
-                int(xyxy[0]),
-                int(xyxy[1]),
-                int(xyxy[2] - xyxy[0]),
-                int(xyxy[3] - xyxy[1]),
+    endpoint = "/infer-image"
+    with stage("upload", endpoint, model):
+        upload = await receive_upload(file, ext)
+    data, content_hash = upload.data, upload.sha256
+    key = RESULT_CACHE.make_key(
+        content_hash,
+        model,
+        confidence,
+        iou,
+        IMGSZ,
+        weights=model_fingerprint(model),
+        tile_size=tile_size,
+        tile_overlap=tile_overlap if tile_size else None,
+    )
+
+    async def compute():
+        # Одно декодирование: оно же и проверка содержимого файла
+        with stage("decode", endpoint, model):
+            img = decode_image(data)
+        if img is None:
+            raise HTTPException(
+                400, detail="Некорректный или повреждённый файл изображения."
             )
-            dets.append(
-                {
-                    "class": class_name,
-                    "confidence": conf,
-                    "bbox": [x, y, w, h],
-                }
+        if tile_size:
+            # Тайлы одного изображения уже составляют батч — мимо micro-batching
+            dets = await run_tiled_inference(
+                model, [img], confidence, iou, endpoint, tile_size, tile_overlap
             )
-        return {"filename": os.path.basename(output_path), "detections": dets}
+            return {
+                "detections": dets.to_frame_lists()[0],
+                "tiles": len(tile_grid(*img.shape[:2], tile_size, tile_overlap)),
+                "timings": {k: round(v, 4) for k, v in dets.timings.items()},
+            }
+        return await IMAGE_BATCHER.submit((model, confidence, iou), img)
+
+    try:
+        dets, cached = await RESULT_CACHE.get_or_compute(key, compute)
+        CACHE_REQUESTS.inc(result="hit" if cached else "miss")
+    except HTTPException:
+        raise
+    except PoolBusyError:
+        raise HTTPException(status_code=503, detail="Сервер перегружен. Попробуйте позже.")
     except Exception:
         raise HTTPException(status_code=500, detail="Ошибка инференса.")
+    extra = {}
+    if tile_size:
+        extra = {"tiles": dets["tiles"], "timings": dets["timings"]}
+        dets = dets["detections"]
+    output_name = None
+    if save_output:
+        # Имя по содержимому: повторная загрузка того же файла не пишет его заново.
+        # На диск попадают исходные байты, без повторного кодирования
+        output_path = f"outputs/{content_hash}.{ext}"
+        with stage("save_output", endpoint, model):
+            if not os.path.exists(output_path):
+                await asyncio.to_thread(write_file, output_path, data)
+                JANITOR.add(output_path)
+            else:
+                JANITOR.touch(output_path)
+        output_name = os.path.basename(output_path)
+    with stage("serialize", endpoint, model):
+        return JSONResponse(
+            {"filename": output_name, "detections": dets, "cached": cached, **extra}
+        )
+
+
+def video_batch_observer(endpoint, model):
+    """Колбэк VideoFramePipeline: время декодирования батча в метрики."""
+
+    def observe(frames, decode_sec, infer_sec):
+        STAGE_SECONDS.observe(
+            decode_sec, stage="video_decode", endpoint=endpoint, model=model
+        )
+
+    return observe
+
+
+async def open_video_upload(file, model, endpoint, first_batch_size=None):
+    """
+    Проверяет и сохраняет загруженное видео.
+    :return: (путь к загрузке, путь к копии в outputs, VideoFramePipeline,
+        sha256 содержимого)
+    """
+    ext = file.filename.split(".")[-1].lower() if "." in file.filename else ""
+    if ext not in SUPPORTED_VIDEO_EXTS:
+        raise HTTPException(status_code=400, detail="Только видео поддерживается.")
+    if model not in MODEL_REGISTRY:
+        raise HTTPException(status_code=400, detail="Модель не поддерживается.")
+    filename = f"uploads/{uuid.uuid4()}.{ext}"
+    with stage("upload", endpoint, model):
+        content_hash = (await receive_upload(file, ext, filename)).sha256
+    JANITOR.add(filename)
+    # Проверка содержимого файла
+    with stage("video_open", endpoint, model):
+        pipeline = VideoFramePipeline(
+            filename,
+            batch_size=VIDEO_BATCH_SIZE,
+            max_frames=VIDEO_MAX_FRAMES,
+            first_batch_size=first_batch_size,
+            on_batch=video_batch_observer(endpoint, model),
+        )
+    if not pipeline.is_opened():
+        pipeline.release()
+        JANITOR.remove(filename)
+        raise HTTPException(400, detail="Некорректный или повреждённый видеофайл.")
+    # Имя по содержимому: одинаковые видео не копируются в outputs повторно
+    output_path = f"outputs/{content_hash}.{ext}"
+    if not os.path.exists(output_path):
+        with stage("copy_output", endpoint, model):
+            await asyncio.to_thread(shutil.copyfile, filename, output_path)
+        JANITOR.add(output_path)
+    else:
+        JANITOR.touch(output_path)
+    return filename, output_path, pipeline, content_hash
 
 
 # Новый эндпоинт для видео (только "авторизованным")
@@ -263,88 +714,334 @@ async def infer_video(
     request: Request,
     file: UploadFile = File(...),
     model: str = Form("small"),
-    confidence: float = Form(0.32), # Добавьте это
-    iou: float = Form(0.5)          # Добавьте это
+    confidence: float = Form(CONFIDENCE),
+    iou: float = Form(IOU),
+    max_stride: int = Form(VIDEO_MAX_STRIDE),
+    tile_size: int = Form(0),
+    tile_overlap: float = Form(TILE_OVERLAP),
     # user=Depends(verify_jwt),
 ):
     check_rate_limit(request)
-    ext = file.filename.split(".")[-1].lower() if "." in file.filename else ""
-    if ext not in SUPPORTED_VIDEO_EXTS:
-        raise HTTPException(status_code=400, detail="Только видео поддерживается.")
-    if model not in PT_MODELS:
-        raise HTTPException(status_code=400, detail="Модель не поддерживается.")
-    filename = f"uploads/{uuid.uuid4()}.{ext}"
-    with open(filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    # Проверка содержимого файла
-    try:
-        cap = cv2.VideoCapture(filename)
-        if not cap.isOpened():
-            os.remove(filename)
-            raise Exception("Некорректный видеофайл")
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    except Exception:
-        if os.path.exists(filename):
-            os.remove(filename)
-        raise HTTPException(400, detail="Некорректный или повреждённый видеофайл.")
-    output_path = f"outputs/{uuid.uuid4()}.{ext}"
-    shutil.copyfile(filename, output_path)
-    detector = PT_MODELS[model]
-    detections_by_frame = []
+    check_tiling(tile_size, tile_overlap)
+    if not 1 <= max_stride <= VIDEO_MAX_STRIDE_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"max_stride должен быть от 1 до {VIDEO_MAX_STRIDE_LIMIT}.",
+        )
+    endpoint = "/infer-video"
+    filename, output_path, pipeline, content_hash = await open_video_upload(
+        file, model, endpoint
+    )
+    key = RESULT_CACHE.make_key(
+        content_hash,
+        model,
+        confidence,
+        iou,
+        IMGSZ,
+        weights=model_fingerprint(model),
+        max_frames=VIDEO_MAX_FRAMES,
+        fmt="columns",
+        max_stride=max_stride,
+        keyframe_threshold=KEYFRAME_THRESHOLD if max_stride > 1 else None,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap if tile_size else None,
+    )
+
+    async def predict_batch(frames):
+        if tile_size:
+            return await run_tiled_inference(
+                model, frames, confidence, iou, endpoint, tile_size, tile_overlap
+            )
+        return await run_inference(model, frames, confidence, iou, endpoint)
+
+    started = False
+
+    async def compute():
+        nonlocal started
+        started = True
+        parts, offsets = [], []
+        if max_stride > 1:
+            selector = KeyframeSelector(max_stride, KEYFRAME_THRESHOLD)
+            batches = detect_keyframes(pipeline, predict_batch, selector)
+        else:
+            batches = pipeline.detect_batches(predict_batch)
+        try:
+            async for first_idx, dets in batches:
+                parts.append(dets)
+                offsets.append(first_idx)
+        finally:
+            JANITOR.remove(filename)
+        stats = pipeline.stats()
+        if max_stride > 1:
+            stats["keyframes"] = selector.keyframes
+        logger.debug(
+            "Видео %s: %s кадров за %s с (%s FPS, batch=%s)",
+            os.path.basename(filename),
+            stats["frames"],
+            stats["elapsed_sec"],
+            stats["fps"],
+            stats["batch_size"],
+        )
+        detections = ColumnarDetections.concat(parts, offsets)
+        return {"columns": detections.to_columns(), "stats": stats}
+
     try:
-        cap = cv2.VideoCapture(filename)
-        frame_idx = 0
-        max_frames = (
-            300  # Ограничение на количество кадров (например, 10 сек при 30 fps)
+        result, cached = await RESULT_CACHE.get_or_compute(key, compute)
+        CACHE_REQUESTS.inc(result="hit" if cached else "miss")
+    except PoolBusyError:
+        raise HTTPException(status_code=503, detail="Сервер перегружен. Попробуйте позже.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка инференса: {str(e)}")
+    finally:
+        # Если инференс запущен, видео и файл освобождает сама задача кэша:
+        # она может пережить этот запрос
+        if not started:
+            pipeline.release()
+            JANITOR.remove(filename)
+    with stage("serialize", endpoint, model):
+        return encode_video_response(
+            request.headers.get("accept", ""),
+            os.path.basename(output_path),
+            ColumnarDetections.from_columns(result["columns"]),
+            result["stats"],
+            cached,
         )
-        while True:
-            ret, frame = cap.read()
-            if not ret or frame_idx >= max_frames:
-                break
-            temp_img_path = f"uploads/temp_{uuid.uuid4()}.jpg"
-            cv2.imwrite(temp_img_path, frame)
-            results = detector.model.predict(
-                source=temp_img_path,
-                conf=detector.confidence,
-                iou=detector.iou,
-                device=detector.device,
+
+
+def encode_video_response(accept, filename, detections, stats, cached):
+    """
+    Ответ /infer-video в формате, который клиент запросил в Accept:
+    MessagePack, сырые little-endian колонки, колоночный JSON или
+    (по умолчанию) прежний JSON со списком детекций по кадрам.
+    """
+    meta = {"filename": filename, "stats": stats, "cached": cached}
+    if MSGPACK_MEDIA_TYPE in accept or "application/msgpack" in accept:
+        try:
+            body = detections.to_msgpack(**meta)
+        except ImportError:
+            raise HTTPException(
+                status_code=406, detail="MessagePack не поддерживается сервером."
             )
-            frame_dets = []
-            boxes = results[0].boxes
-            names = detector.model.names
-            indices = filter_boxes_by_confidence(boxes, detector.confidence)
-            for i in indices:
-                xyxy = boxes.xyxy[i].tolist()
-                conf = float(boxes.conf[i])
-                cls_idx = int(boxes.cls[i])
-                class_name = names[cls_idx] if cls_idx < len(names) else str(cls_idx)
-                x, y, w, h = (
-                    int(xyxy[0]),
-                    int(xyxy[1]),
-                    int(xyxy[2] - xyxy[0]),
-                    int(xyxy[3] - xyxy[1]),
+        return Response(body, media_type=MSGPACK_MEDIA_TYPE)
+    if BINARY_MEDIA_TYPE in accept:
+        return Response(detections.to_binary(**meta), media_type=BINARY_MEDIA_TYPE)
+    if COLUMNAR_JSON_MEDIA_TYPE in accept:
+        return JSONResponse(
+            {**meta, "detections": detections.to_columns()},
+            media_type=COLUMNAR_JSON_MEDIA_TYPE,
+        )
+    detections_by_frame = [
+        {"frame": frame_idx, "detections": frame_dets}
+        for frame_idx, frame_dets in enumerate(detections.to_frame_lists())
+    ]
+    if detections.inferred is not None:
+        for entry, inferred in zip(detections_by_frame, detections.inferred.tolist()):
+            entry["inferred"] = inferred
+    return JSONResponse({**meta, "detections": detections_by_frame})
+
+
+def format_stream_record(record, stream_format):
+    """Одна запись стрима: строка NDJSON или событие Server-Sent Events."""
+    payload = json.dumps(record, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {record['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+# Стриминг детекций по мере готовности батчей (NDJSON или SSE)
+@app.post("/infer-video-stream")
+async def infer_video_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    model: str = Form("small"),
+    confidence: float = Form(CONFIDENCE),
+    iou: float = Form(IOU),
+    stream_format: str = Form(None),
+):
+    check_rate_limit(request)
+    if stream_format is None:
+        accept = request.headers.get("accept", "")
+        stream_format = "sse" if "text/event-stream" in accept else "ndjson"
+    if stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Формат стрима: ndjson или sse.")
+    # Первый батч из одного кадра — клиент сразу получает первый результат
+    endpoint = "/infer-video-stream"
+    filename, output_path, pipeline, _ = await open_video_upload(
+        file, model, endpoint, first_batch_size=1
+    )
+
+    async def predict_batch(frames):
+        dets = await run_inference(model, frames, confidence, iou, endpoint)
+        return dets.to_frame_lists()
+
+    async def records():
+        try:
+            async for first_idx, dets in pipeline.detect_batches(predict_batch):
+                frames = [
+                    {"frame": first_idx + offset, "detections": frame_dets}
+                    for offset, frame_dets in enumerate(dets)
+                ]
+                yield format_stream_record(
+                    {"type": "frames", "frames": frames}, stream_format
                 )
-                frame_dets.append(
-                    {
-                        "class": class_name,
-                        "confidence": conf,
-                        "bbox": [x, y, w, h],
-                    }
+            yield format_stream_record(
+                {
+                    "type": "summary",
+                    "filename": os.path.basename(output_path),
+                    "total_frames": pipeline.frames_done,
+                    "stats": pipeline.stats(),
+                },
+                stream_format,
+            )
+        except PoolBusyError:
+            yield format_stream_record(
+                {"type": "error", "detail": "Сервер перегружен. Попробуйте позже."},
+                stream_format,
+            )
+        except Exception as e:
+            yield format_stream_record(
+                {"type": "error", "detail": f"Ошибка инференса: {str(e)}"},
+                stream_format,
+            )
+        finally:
+            JANITOR.remove(filename)
+
+    return StreamingResponse(
+        records(),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Асинхронные видео-задания: отправка, опрос прогресса, результат, отмена ---
+VIDEO_JOB_QUEUE_SIZE = int(os.getenv("VIDEO_JOB_QUEUE_SIZE", 8))
+VIDEO_JOB_WORKERS = int(os.getenv("VIDEO_JOB_WORKERS", 1))
+# У заданий нет таймаута HTTP-запроса, поэтому по умолчанию без ограничения кадров
+VIDEO_JOB_MAX_FRAMES = int(os.getenv("VIDEO_JOB_MAX_FRAMES", 0))
+
+
+async def process_video_job(job, progress):
+    """
+    Обрабатывает видео задания. Детекции пишутся в JSON-файл результата
+    по мере готовности, чтобы память не росла с длиной видео.
+    :return: (число обработанных кадров, FPS)
+    """
+    endpoint = "/jobs/video"
+    pipeline = VideoFramePipeline(
+        job["upload_path"],
+        batch_size=VIDEO_BATCH_SIZE,
+        max_frames=VIDEO_JOB_MAX_FRAMES,
+        on_batch=video_batch_observer(endpoint, job["model"]),
+    )
+    # Видео уже открыто, а после задания загрузку удаляет очередь:
+    # защита от вытеснения по квоте больше не нужна
+    JANITOR.release(job["upload_path"])
+    total = pipeline.total_frames
+
+    async def predict_batch(frames):
+        dets = await run_inference(
+            job["model"], frames, job["confidence"], job["iou"], endpoint
+        )
+        return dets.to_frame_lists()
+
+    with open(job["result_path"], "w", encoding="utf-8") as out:
+        out.write(
+            '{"filename": %s, "detections": ['
+            % json.dumps(os.path.basename(job["output_path"]))
+        )
+        first = True
+        async for frame_idx, frame_dets in pipeline.detect(predict_batch):
+            if not first:
+                out.write(", ")
+            first = False
+            out.write(
+                json.dumps(
+                    {"frame": frame_idx, "detections": frame_dets}, ensure_ascii=False
                 )
-            detections_by_frame.append({"frame": frame_idx, "detections": frame_dets})
-            os.remove(temp_img_path)
-            frame_idx += 1
-        cap.release()
-        if os.path.exists(filename):
-            os.remove(filename)
-        return {
-            "filename": os.path.basename(output_path),
-            "detections": detections_by_frame,
-        }
-    except Exception as e:
-        if os.path.exists(filename):
-            os.remove(filename)
-        raise HTTPException(status_code=500, detail=f"Ошибка инференса: {str(e)}")
+            )
+            progress(pipeline.frames_done, total, pipeline.throughput)
+        out.write('], "stats": %s}' % json.dumps(pipeline.stats()))
+    return pipeline.frames_done, pipeline.throughput
+
+
+VIDEO_JOBS = VideoJobQueue(
+    VideoJobStore("jobs/jobs.sqlite3"),
+    process_video_job,
+    max_queue=VIDEO_JOB_QUEUE_SIZE,
+    workers=VIDEO_JOB_WORKERS,
+)
+QUEUE_DEPTH.set_function(lambda: VIDEO_JOBS.queue_depth, queue="video_jobs")
+
+
+@app.on_event("startup")
+async def start_video_jobs():
+    VIDEO_JOBS.start()
+
+
+@app.on_event("shutdown")
+async def stop_video_jobs():
+    await VIDEO_JOBS.stop()
+
+
+@app.post("/jobs/video")
+async def submit_video_job(
+    request: Request,
+    file: UploadFile = File(...),
+    model: str = Form("small"),
+    confidence: float = Form(CONFIDENCE),
+    iou: float = Form(IOU),
+):
+    check_rate_limit(request)
+    # Отказываем до записи файла на диск, если очередь уже заполнена
+    if VIDEO_JOBS.queue_depth >= VIDEO_JOB_QUEUE_SIZE:
+        raise HTTPException(status_code=503, detail="Очередь заданий заполнена.")
+    filename, output_path, pipeline, _ = await open_video_upload(
+        file, model, "/jobs/video"
+    )
+    pipeline.release()
+    # Загрузка ждёт в очереди: квота не должна её вытеснить
+    JANITOR.hold(filename)
+    try:
+        job = VIDEO_JOBS.submit(
+            model=model,
+            confidence=confidence,
+            iou=iou,
+            upload_path=filename,
+            output_path=output_path,
+            result_path=f"jobs/{uuid.uuid4().hex}.json",
+        )
+    except QueueFullError:
+        # Копия в outputs общая для одинаковых видео (имя по содержимому) —
+        # её URL уже могли выдать, она уйдёт по квоте
+        JANITOR.remove(filename)
+        raise HTTPException(status_code=503, detail="Очередь заданий заполнена.")
+    return {"job_id": job["id"], "status": job["status"]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_video_job(job_id: str):
+    status = VIDEO_JOBS.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    return status
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_video_job_result(job_id: str):
+    job = VIDEO_JOBS.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    if job["status"] != DONE:
+        raise HTTPException(
+            status_code=409, detail=f"Задание не завершено: {job['status']}."
+        )
+    return FileResponse(job["result_path"], media_type="application/json")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_video_job(job_id: str):
+    if VIDEO_JOBS.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    if not VIDEO_JOBS.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Задание уже завершено.")
+    return {"job_id": job_id, "status": "cancelled"}
@@ -0,0 +1,237 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы бакетов гистограмм латентности, секунды
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self._collect():
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+    def _collect(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class _FunctionMetric(_Metric):
+    """Метрика, значение которой можно читать функцией при экспорте."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._functions = {}
+
+    def set_function(self, fn, **labels):
+        self._functions[self._key(labels)] = fn
+
+    def _collect(self):
+        values = dict(super()._collect())
+        for key, fn in self._functions.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return sorted(values.items())
+
+
+class Counter(_FunctionMetric):
+    """
+    Counter; вместо inc значение можно читать функцией, если объект сам
+    ведёт монотонный счётчик (например, число вытесненных файлов).
+    """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_FunctionMetric):
+    """Gauge; значение можно задавать явно или функцией, которая читается при экспорте."""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(
+                    self.label_names, key, ("le", _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = Histogram(
+    "raptor_stage_seconds",
+    "Время этапа обработки запроса",
+    labels=("stage", "endpoint", "model"),
+)
+REQUEST_SECONDS = Histogram(
+    "raptor_request_seconds",
+    "Полное время обработки HTTP-запроса",
+    labels=("endpoint", "status"),
+)
+IN_FLIGHT = Gauge(
+    "raptor_requests_in_flight",
+    "Запросы, которые сейчас обрабатываются",
+    labels=("endpoint",),
+)
+QUEUE_DEPTH = Gauge(
+    "raptor_queue_depth",
+    "Глубина очередей: батчер изображений, пул инференса, видео-задания",
+    labels=("queue",),
+)
+RATE_LIMITED = Counter(
+    "raptor_rate_limited_total",
+    "Запросы, отклонённые rate limit",
+    labels=("endpoint",),
+)
+FRAMES = Counter(
+    "raptor_frames_total",
+    "Обработанные кадры и изображения (rate() даёт кадры в секунду)",
+    labels=("endpoint", "model"),
+)
+CACHE_REQUESTS = Counter(
+    "raptor_result_cache_requests_total",
+    "Обращения к кэшу результатов",
+    labels=("result",),
+)
+DISK_BYTES = Gauge(
+    "raptor_disk_bytes",
+    "Место, занятое файлами в каталогах с квотой",
+    labels=("directory",),
+)
+DISK_EVICTED = Counter(
+    "raptor_disk_evicted_files_total",
+    "Файлы, удалённые по квоте или возрасту с момента запуска",
+)
+
+
+def stage(name, endpoint="", model=""):
+    """Контекстный менеджер: время этапа в raptor_stage_seconds."""
+    return STAGE_SECONDS.time(stage=name, endpoint=endpoint, model=model)
@@ -0,0 +1,141 @@
+import gc
+import json
+import os
+import platform
+import threading
+import time
+from collections import OrderedDict
+
+
+def _rss_bytes():
+    """Resident memory текущего процесса (Linux), 0 если недоступно."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def load_manifest(path, names=None):
+    """
+    Лучшие артефакты моделей из манифеста cv_pipeline/scripts/export_benchmark.py.
+    Относительные пути считаются от папки манифеста; отсутствующие артефакты
+    пропускаются.
+    :param names: какие модели брать (None — все)
+    :return: {имя модели: {"backend": ..., "path": ..., "options": {...}}}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    host = manifest.get("host")
+    if host and host != platform.node():
+        print(
+            f"Манифест {path} замерен на {host}, а не на {platform.node()}: "
+            f"выбранный бэкенд может быть не самым быстрым"
+        )
+    base = os.path.dirname(os.path.abspath(path))
+    artifacts = {}
+    for name, entry in manifest.get("models", {}).items():
+        if names is not None and name not in names:
+            print(f"Модель {name} из манифеста не обслуживается, пропущена")
+            continue
+        artifact = dict(entry["best"])
+        artifact["path"] = os.path.join(base, artifact["path"])
+        if not os.path.exists(artifact["path"]):
+            print(f"Артефакт модели {name} не найден: {artifact['path']}")
+            continue
+        artifacts[name] = artifact
+    return artifacts
+
+
+class ModelRegistry:
+    """
+    Ленивый реестр моделей: модель загружается при первом обращении,
+    прогревается пустым forward pass и вытесняется по LRU, когда суммарная
+    память загруженных моделей превышает бюджет.
+    Потокобезопасен: одновременные первые запросы ждут одну загрузку.
+    """
+
+    def __init__(self, model_paths, loader, memory_budget_bytes=0, warmup=True):
+        """
+        :param model_paths: {имя модели: путь к весам}
+        :param loader: функция (имя модели, path) -> детектор
+        :param memory_budget_bytes: бюджет памяти на модели (0 — без ограничения)
+        :param warmup: делать ли прогревочный forward pass после загрузки
+        """
+        self.model_paths = dict(model_paths)
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.warmup = warmup
+        self._models = OrderedDict()  # name -> detector, от давно не используемых к свежим
+        self._sizes = {}  # name -> байты
+        self._lock = threading.Lock()
+        # Загрузки выполняются по одной: так замер прироста RSS относится
+        # ровно к загружаемой модели
+        self._load_lock = threading.Lock()
+        self.evictions = 0
+
+    def __contains__(self, name):
+        path = self.model_paths.get(name)
+        return path is not None and os.path.exists(path)
+
+    @property
+    def memory_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def get(self, name):
+        """Возвращает загруженный детектор, загружая его при необходимости."""
+        with self._lock:
+            detector = self._models.get(name)
+            if detector is not None:
+                self._models.move_to_end(name)
+                return detector
+        with self._load_lock:
+            with self._lock:
+                detector = self._models.get(name)
+                if detector is not None:
+                    self._models.move_to_end(name)
+                    return detector
+            return self._load(name)
+
+    def _load(self, name):
+        path = self.model_paths[name]
+        start = time.perf_counter()
+        rss_before = _rss_bytes()
+        detector = self.loader(name, path)
+        if self.warmup and hasattr(detector, "warmup"):
+            detector.warmup()
+        size = max(_rss_bytes() - rss_before, 0)
+        if hasattr(detector, "memory_bytes"):
+            size = max(size, detector.memory_bytes())
+        with self._lock:
+            self._models[name] = detector
+            self._sizes[name] = size
+            evicted = self._evict(keep=name)
+        if evicted:
+            gc.collect()
+        print(
+            f"Модель {name} загружена за {time.perf_counter() - start:.1f} с "
+            f"(~{size // (1024 * 1024)} МБ), выгружены: {evicted or 'нет'}"
+        )
+        return detector
+
+    def _evict(self, keep):
+        evicted = []
+        if not self.memory_budget_bytes:
+            return evicted
+        while sum(self._sizes.values()) > self.memory_budget_bytes:
+            name = next((n for n in self._models if n != keep), None)
+            if name is None:
+                break
+            # Запросы, уже получившие детектор, доработают с ним до конца
+            del self._models[name]
+            del self._sizes[name]
+            evicted.append(name)
+            self.evictions += 1
+        return evicted
+
+    def loaded(self):
+        """Список загруженных моделей и их размер в байтах."""
+        with self._lock:
+            return {name: self._sizes[name] for name in self._models}
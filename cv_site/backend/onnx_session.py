@@ -0,0 +1,185 @@
+import os
+import queue
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# Типы тензоров ONNX -> numpy, для буферов выходов
+TENSOR_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+    "tensor(uint8)": np.uint8,
+    "tensor(bool)": np.bool_,
+}
+
+
+def default_providers():
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+
+class PooledSession:
+    """
+    Сессия из пула вместе с IOBinding и буферами выходов.
+    Буферы переиспользуются между вызовами, поэтому результаты run()
+    действительны только до возврата сессии в пул.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.outputs = session.get_outputs()
+        self._binding = session.io_binding()
+        self._buffers = {}  # форма входа -> список буферов выходов
+        # Входные буферы владельца пула (ONNXDetector.detect_batch): живут
+        # вместе с сессией и используются только тем, кто её взял
+        self.inputs = None
+
+    def _output_buffers(self, input_shape):
+        buffers = self._buffers.get(input_shape)
+        if buffers is not None:
+            return buffers
+        buffers = []
+        for output in self.outputs:
+            shape = list(output.shape)
+            # Динамическая размерность батча совпадает с батчем входа
+            if shape and not isinstance(shape[0], int):
+                shape[0] = input_shape[0]
+            dtype = TENSOR_TYPES.get(output.type)
+            if dtype is None or not all(isinstance(d, int) for d in shape):
+                # Форма выхода зависит от данных — буфер выделит ORT
+                buffers = None
+                break
+            buffers.append(np.empty(shape, dtype=dtype))
+        self._buffers[input_shape] = buffers
+        return buffers
+
+    def run(self, batch):
+        """
+        Инференс батча через IOBinding.
+        :param batch: np.ndarray входа модели
+        :return: список выходов (np.ndarray)
+        """
+        batch = np.ascontiguousarray(batch)
+        binding = self._binding
+        binding.clear_binding_inputs()
+        binding.clear_binding_outputs()
+        binding.bind_cpu_input(self.input_name, batch)
+        buffers = self._output_buffers(batch.shape)
+        if buffers is None:
+            for output in self.outputs:
+                binding.bind_output(output.name, "cpu")
+            self.session.run_with_iobinding(binding)
+            return binding.copy_outputs_to_cpu()
+        for output, buf in zip(self.outputs, buffers):
+            binding.bind_output(
+                output.name, "cpu", 0, buf.dtype, buf.shape, buf.ctypes.data
+            )
+        self.session.run_with_iobinding(binding)
+        return buffers
+
+
+class SessionPool:
+    """
+    Пул долгоживущих сессий ONNX Runtime одной модели. Сессии создаются
+    один раз; каждый поток берёт сессию в монопольное пользование на время
+    запроса, поэтому IOBinding и буферы выходов не делятся между потоками.
+    """
+
+    def __init__(
+        self,
+        model_path,
+        size=1,
+        providers=None,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        graph_optimization="all",
+        optimized_model_path=None,
+        enable_mem_arena=True,
+        enable_mem_pattern=True,
+        parallel_execution=False,
+    ):
+        """
+        :param size: число сессий (сколько запросов выполняется параллельно)
+        :param intra_op_threads: потоков внутри оператора (0 — решает ORT)
+        :param inter_op_threads: потоков между операторами (для parallel_execution)
+        :param graph_optimization: disable, basic, extended или all
+        :param optimized_model_path: файл, куда сохраняется оптимизированный граф;
+            при следующих запусках он загружается без повторной оптимизации.
+            Граф уровня all привязан к железу — для переноса между машинами extended
+        :param enable_mem_arena: арена памяти CPU (быстрее, но память не отдаётся ОС)
+        :param enable_mem_pattern: предвыделение памяти по шаблону первого запуска
+        """
+        if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Неизвестный уровень оптимизации: {graph_optimization}")
+        self.model_path = model_path
+        self.providers = providers or default_providers()
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+        self.optimized_model_path = optimized_model_path
+        self.enable_mem_arena = enable_mem_arena
+        self.enable_mem_pattern = enable_mem_pattern
+        self.parallel_execution = parallel_execution
+        self._idle = queue.Queue()
+        self.sessions = [PooledSession(self._create()) for _ in range(max(1, size))]
+        for session in self.sessions:
+            self._idle.put(session)
+        first = self.sessions[0]
+        self.input_name = first.input_name
+        self.input_shape = first.session.get_inputs()[0].shape
+
+    def _options(self, level):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+        options.enable_cpu_mem_arena = self.enable_mem_arena
+        options.enable_mem_pattern = self.enable_mem_pattern
+        options.execution_mode = (
+            ort.ExecutionMode.ORT_PARALLEL
+            if self.parallel_execution
+            else ort.ExecutionMode.ORT_SEQUENTIAL
+        )
+        return options
+
+    def _cached_model_fresh(self):
+        path = self.optimized_model_path
+        return (
+            path is not None
+            and os.path.exists(path)
+            and os.path.getmtime(path) >= os.path.getmtime(self.model_path)
+        )
+
+    def _create(self):
+        if self._cached_model_fresh():
+            # Граф уже оптимизирован — повторная оптимизация не нужна
+            options = self._options("disable")
+            return ort.InferenceSession(
+                self.optimized_model_path, options, providers=self.providers
+            )
+        options = self._options(self.graph_optimization)
+        if self.optimized_model_path:
+            options.optimized_model_filepath = self.optimized_model_path
+        return ort.InferenceSession(self.model_path, options, providers=self.providers)
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Берёт свободную сессию из пула на время блока with."""
+        session = self._idle.get(timeout=timeout)
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
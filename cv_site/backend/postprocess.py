@@ -0,0 +1,148 @@
+import numpy as np
+
+# Сколько самых уверенных боксов каждой группы (кадр, класс) идёт в NMS
+MAX_CANDIDATES = 1000
+
+
+def xywh_to_xyxy(xywh):
+    xywh = np.asarray(xywh, dtype=np.float32).reshape(-1, 4)
+    xyxy = xywh.copy()
+    xyxy[:, 2:] += xyxy[:, :2]
+    return xyxy
+
+
+def box_iou(a, b):
+    """
+    Матрица IoU между двумя наборами боксов (x1, y1, x2, y2).
+    :return: np.ndarray (len(a), len(b))
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).clip(0).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).clip(0).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def nms(
+    xyxy,
+    scores,
+    iou_threshold,
+    ios_threshold=None,
+    max_candidates=MAX_CANDIDATES,
+):
+    """
+    NMS без цикла по боксам: матрица перекрытий считается одной векторной
+    операцией по top-k кандидатам, подавление — итерациями по маскам
+    (Cluster-NMS, результат совпадает с жадным NMS).
+    :param ios_threshold: дополнительно подавлять боксы, лежащие внутри
+        более уверенного больше чем на эту долю (None — только IoU)
+    :param max_candidates: сколько самых уверенных боксов рассматривать
+        (память и время — O(max_candidates²))
+    :return: индексы оставленных боксов по убыванию уверенности
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    order = np.argsort(-scores, kind="stable")[:max_candidates]
+    boxes = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)[order]
+    areas = (boxes[:, 2:] - boxes[:, :2]).clip(0).prod(axis=1)
+    lt = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    rb = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    union = areas[:, None] + areas[None, :] - inter
+    overlap = inter > iou_threshold * np.maximum(union, 1e-9)
+    if ios_threshold is not None:
+        smaller = np.minimum(areas[:, None], areas[None, :])
+        overlap |= inter > ios_threshold * np.maximum(smaller, 1e-9)
+    # Бокс может подавить только менее уверенный (правее по строке)
+    overlap = np.triu(overlap, k=1)
+    # Бокс остаётся, если его не перекрывает ни один оставленный; итерации
+    # сходятся к решению жадного NMS за число шагов не больше глубины цепочки
+    keep = np.ones(len(order), dtype=bool)
+    while True:
+        new_keep = ~(overlap & keep[:, None]).any(axis=0)
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+    return order[keep]
+
+
+def batched_nms(
+    xyxy,
+    scores,
+    groups,
+    iou_threshold,
+    ios_threshold=None,
+    max_candidates=MAX_CANDIDATES,
+):
+    """
+    NMS отдельно внутри каждой группы (кадр, класс): боксы разных групп
+    не подавляют друг друга, top-k кандидатов отбирается в каждой группе.
+    Цикл — по группам, а не по боксам.
+    :return: индексы оставленных боксов по убыванию уверенности
+    """
+    xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32)
+    groups = np.asarray(groups)
+    if not len(xyxy):
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(groups, kind="stable")
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+    keep = []
+    for index in np.split(order, bounds):
+        kept = nms(
+            xyxy[index], scores[index], iou_threshold, ios_threshold, max_candidates
+        )
+        keep.append(index[kept])
+    keep = np.concatenate(keep)
+    return keep[np.argsort(-scores[keep], kind="stable")]
+
+
+def postprocess_batch(pred, confidence, iou, gain, pad, shapes):
+    """
+    Разбор выхода детектора с NMS сразу для всего батча, без цикла по боксам.
+    :param pred: (B, N, 6) — x1, y1, x2, y2, conf, class во входных координатах
+        модели (без столбца класса — класс 0)
+    :param gain: масштаб вход модели / исходный кадр по осям (x, y): (2,) или (B, 2)
+    :param pad: отступ letterbox (x, y) во входе модели: (2,) или (B, 2)
+    :param shapes: размеры исходных кадров (height, width): (2,) или (B, 2)
+    :return: (frame_idx, xyxy, conf, class_id) — боксы в координатах исходных
+        кадров после NMS по кадрам и классам, упорядочены по кадрам
+    """
+    pred = np.asarray(pred)
+    num_frames = pred.shape[0]
+    mask = pred[..., 4] >= confidence
+    frame_idx = np.nonzero(mask)[0]
+    rows = pred[mask]
+    conf = rows[:, 4].astype(np.float32)
+    if pred.shape[2] > 5:
+        class_id = rows[:, 5].astype(np.int64)
+    else:
+        class_id = np.zeros(len(rows), dtype=np.int64)
+
+    def per_frame(value):
+        value = np.asarray(value, dtype=np.float32).reshape(-1, 2)
+        return np.broadcast_to(value, (num_frames, 2))[frame_idx]
+
+    gain, pad, shapes = per_frame(gain), per_frame(pad), per_frame(shapes)
+    xyxy = (rows[:, :4] - np.tile(pad, 2)) / np.tile(gain, 2)
+    # shapes — (height, width), а координаты идут (x, y, x, y)
+    np.clip(xyxy, 0, np.tile(shapes[:, ::-1], 2), out=xyxy)
+    num_classes = int(class_id.max(initial=0)) + 1
+    keep = batched_nms(xyxy, conf, frame_idx * num_classes + class_id, iou)
+    keep = keep[np.argsort(frame_idx[keep], kind="stable")]
+    return frame_idx[keep], xyxy[keep], conf[keep], class_id[keep]
+
+
+def split_by_frame(frame_idx, num_frames, *arrays):
+    """
+    Разбивает упорядоченные по кадрам массивы на части по кадрам.
+    :return: список длины num_frames из кортежей срезов arrays
+    """
+    bounds = np.searchsorted(frame_idx, np.arange(num_frames + 1))
+    return [
+        tuple(array[bounds[i] : bounds[i + 1]] for array in arrays)
+        for i in range(num_frames)
+    ]
@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+INPUT_SIZE = 640
+PAD_VALUE = 114  # серый фон letterbox, как при обучении YOLO
+
+
+def letterbox_geometry(height, width, size=INPUT_SIZE):
+    """
+    Масштаб и отступы для вписывания кадра в квадрат size x size
+    с сохранением пропорций.
+    :return: (gain, (pad_x, pad_y), (new_width, new_height))
+    """
+    gain = min(size / height, size / width)
+    new_width = max(1, int(round(width * gain)))
+    new_height = max(1, int(round(height * gain)))
+    pad = ((size - new_width) // 2, (size - new_height) // 2)
+    return gain, pad, (new_width, new_height)
+
+
+class LetterboxBatch:
+    """
+    Переиспользуемый входной батч модели NCHW float32. Кадр BGR пишется
+    сразу в свой слот: resize в заранее выделенный буфер, затем каналы
+    в обратном порядке (BGR -> RGB) с нормировкой /255 прямо в батч —
+    без промежуточных массивов на кадр и без np.stack.
+    Кадры в слотах могут быть разного размера: геометрия letterbox
+    хранится для каждого слота.
+    """
+
+    def __init__(self, batch_size, size=INPUT_SIZE, pad_value=PAD_VALUE):
+        self.size = size
+        self.pad_value = pad_value / 255.0
+        self.batch = np.full((batch_size, 3, size, size), self.pad_value, np.float32)
+        # По слотам: масштаб, отступ (x, y) и размер исходного кадра (height, width)
+        self.gains = np.ones(batch_size, dtype=np.float32)
+        self.pads = np.zeros((batch_size, 2), dtype=np.float32)
+        self.shapes = np.zeros((batch_size, 2), dtype=np.float32)
+        self._slot_shapes = [None] * batch_size
+        self._resized = np.empty((0, 0, 3), dtype=np.uint8)  # буфер resize
+
+    def _prepare(self, index, height, width):
+        """:return: буфер resize для кадра такого размера"""
+        gain, pad, (new_width, new_height) = letterbox_geometry(
+            height, width, self.size
+        )
+        if self._slot_shapes[index] != (height, width):
+            # Поля letterbox одинаковы для всех кадров такого размера —
+            # слот заливается, только когда размер кадра в нём меняется
+            self.batch[index].fill(self.pad_value)
+            self._slot_shapes[index] = (height, width)
+            self.gains[index] = gain
+            self.pads[index] = pad
+            self.shapes[index] = (height, width)
+        if self._resized.shape[:2] != (new_height, new_width):
+            self._resized = np.empty((new_height, new_width, 3), dtype=np.uint8)
+        return self._resized
+
+    def put(self, index, frame):
+        """
+        Записывает кадр в слот index.
+        :param frame: np.ndarray (H, W, 3) uint8, BGR
+        """
+        height, width = frame.shape[:2]
+        resized = self._prepare(index, height, width)
+        cv2.resize(
+            frame,
+            (resized.shape[1], resized.shape[0]),
+            dst=resized,
+            interpolation=cv2.INTER_LINEAR,
+        )
+        x, y = self.pads[index].astype(int)
+        h, w = resized.shape[:2]
+        slot = self.batch[index, :, y : y + h, x : x + w]
+        for channel in range(3):
+            np.multiply(resized[:, :, 2 - channel], 1 / 255.0, out=slot[channel])
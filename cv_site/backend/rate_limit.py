@@ -0,0 +1,202 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket: limit запросов за period секунд с равномерным пополнением.
+    Стоимость проверки постоянна и не зависит от истории запросов клиента.
+    Состояние корзин хранит backend (память процесса, shared memory, Redis).
+    """
+
+    def __init__(self, backend, limit, period):
+        self.backend = backend
+        self.capacity = float(limit)
+        self.refill_rate = limit / period  # токенов в секунду
+        self.rejected = 0
+
+    def allow(self, key):
+        allowed = self.backend.take(key, self.capacity, self.refill_rate, time.time())
+        if not allowed:
+            self.rejected += 1
+        return allowed
+
+
+def _refill(tokens, updated, capacity, refill_rate, now):
+    return min(capacity, tokens + max(now - updated, 0.0) * refill_rate)
+
+
+class MemoryBackend:
+    """
+    Корзины в памяти процесса. Ключи хранятся в порядке последнего
+    обращения, поэтому простаивающие ключи вытесняются с начала очереди
+    за амортизированное O(1): корзина, простоявшая время полного пополнения,
+    ничем не отличается от отсутствующей.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, capacity, refill_rate, now):
+        idle_after = capacity / refill_rate
+        with self._lock:
+            while self._buckets:
+                oldest, (_, updated) = next(iter(self._buckets.items()))
+                if now - updated < idle_after and len(self._buckets) < self.max_keys:
+                    break
+                del self._buckets[oldest]
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = _refill(tokens, updated, capacity, refill_rate, now)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+
+_SLOT_DTYPE = np.dtype([("key", "<u8"), ("tokens", "<f8"), ("updated", "<f8")])
+
+
+class SharedMemoryBackend:
+    """
+    Корзины в таблице фиксированного размера в shared memory, общей для
+    всех процессов uvicorn на машине. Ключ хэшируется в слот с линейным
+    пробированием; слот простаивающего ключа переиспользуется, так что
+    память ограничена размером таблицы. Изменения сериализуются flock.
+    """
+
+    PROBES = 8
+
+    def __init__(self, name="raptor_rate_limit", slots=65536, lock_path=None):
+        # Только для Unix: импорт здесь, чтобы остальные бэкенды работали везде
+        import fcntl
+
+        self._fcntl = fcntl
+        size = slots * _SLOT_DTYPE.itemsize
+        try:
+            # Новый сегмент заполнен нулями — это пустые слоты
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # Таблица общая для всех процессов, ни один из них не должен удалять её при выходе
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._table = np.ndarray(
+            (self._shm.size // _SLOT_DTYPE.itemsize,),
+            dtype=_SLOT_DTYPE,
+            buffer=self._shm.buf,
+        )
+        lock_path = lock_path or os.path.join("/tmp", f"{name}.lock")
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key):
+        # hash() в Python различается между процессами, поэтому blake2b.
+        # 0 зарезервирован под пустой слот
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def take(self, key, capacity, refill_rate, now):
+        key_hash = self._hash(key)
+        idle_after = capacity / refill_rate
+        n = len(self._table)
+        with self._thread_lock:
+            self._fcntl.flock(self._lock_fd, self._fcntl.LOCK_EX)
+            try:
+                slot = None
+                for probe in range(self.PROBES):
+                    i = (key_hash + probe) % n
+                    entry = self._table[i]
+                    if entry["key"] == key_hash:
+                        slot = i
+                        break
+                    if slot is None and (
+                        entry["key"] == 0 or now - entry["updated"] >= idle_after
+                    ):
+                        slot = i
+                if slot is None:
+                    # Таблица переполнена в этой области — вытесняем самый старый слот
+                    slot = min(
+                        ((key_hash + p) % n for p in range(self.PROBES)),
+                        key=lambda i: self._table[i]["updated"],
+                    )
+                entry = self._table[slot]
+                if entry["key"] == key_hash:
+                    tokens = _refill(
+                        float(entry["tokens"]),
+                        float(entry["updated"]),
+                        capacity,
+                        refill_rate,
+                        now,
+                    )
+                else:
+                    tokens = capacity
+                allowed = tokens >= 1.0
+                if allowed:
+                    tokens -= 1.0
+                self._table[slot] = (key_hash, tokens, now)
+                return allowed
+            finally:
+                self._fcntl.flock(self._lock_fd, self._fcntl.LOCK_UN)
+
+
+class RedisBackend:
+    """Корзины в Redis (или совместимом сервере): общие для нескольких машин."""
+
+    # Атомарная проверка корзины на стороне сервера
+    _SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+if tokens == nil then
+  tokens = capacity
+  updated = now
+end
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return allowed
+"""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self._SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, capacity, refill_rate, now):
+        return bool(
+            self._take(keys=[self.prefix + key], args=[capacity, refill_rate, now])
+        )
+
+
+def make_backend(kind, redis_url=None):
+    """Создаёт backend по имени: memory, shm или redis."""
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "shm":
+        return SharedMemoryBackend()
+    if kind == "redis":
+        if not redis_url:
+            raise ValueError("Для RATE_LIMIT_BACKEND=redis нужен REDIS_URL")
+        return RedisBackend(redis_url)
+    raise ValueError(f"Неизвестный RATE_LIMIT_BACKEND: {kind}")
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Кэш результатов инференса по содержимому файла.
+    Два уровня: ограниченный по числу записей LRU в памяти и ограниченный
+    по размеру каталог на диске. Одновременные одинаковые запросы
+    склеиваются: инференс выполняется один раз, остальные ждут результат.
+    """
+
+    def __init__(self, cache_dir, memory_items=256, disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # key -> value
+        self._disk = OrderedDict()  # key -> размер файла, от старых к новым
+        self._disk_size = 0
+        self._inflight = {}  # key -> asyncio.Task
+        self._writes = set()  # фоновые записи на диск (ссылки, чтобы их не собрал GC)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    @staticmethod
+    def make_key(content_hash, model, confidence, iou, imgsz, **extra):
+        parts = [content_hash, model, f"{confidence:.4f}", f"{iou:.4f}", str(imgsz)]
+        parts += [f"{name}={extra[name]}" for name in sorted(extra)]
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    async def get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if key in self._disk:
+            # Чтение и разбор JSON (у видео — мегабайты) — вне event loop
+            try:
+                value = await asyncio.to_thread(self._read_disk, key)
+            except (OSError, ValueError):
+                await self._drop_disk([key])
+                return None
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, value)
+            return value
+        return None
+
+    async def put(self, key, value):
+        self._put_memory(key, value)
+        try:
+            size = await asyncio.to_thread(self._write_disk, key, value)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Не удалось записать результат в кэш: {e}")
+            return
+        if size is None:
+            return
+        # Индекс меняется только в event loop, файлы — в потоках
+        self._disk_size -= self._disk.pop(key, 0)
+        self._disk[key] = size
+        self._disk_size += size
+        evicted = []
+        while self._disk_size > self.disk_bytes:
+            evicted.append(next(iter(self._disk)))
+            self._disk_size -= self._disk.pop(evicted[-1])
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    def _put_memory(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        with open(self._path(key), "r", encoding="utf-8") as f:
+            value = json.load(f)
+        os.utime(self._path(key))
+        return value
+
+    def _write_disk(self, key, value):
+        """:return: размер записанного файла или None, если он больше кэша"""
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.disk_bytes:
+            return None
+        # Через временный файл: параллельный get не увидит файл наполовину
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return len(data)
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    async def _drop_disk(self, keys):
+        for key in keys:
+            self._disk_size -= self._disk.pop(key, 0)
+        await asyncio.to_thread(self._remove_files, keys)
+
+    async def get_or_compute(self, key, compute):
+        """
+        Возвращает результат из кэша или вычисляет его через compute().
+        :param compute: async-функция без аргументов
+        :return: (результат, True если взят из кэша)
+        """
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, True
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            # Отдельная задача: если первый клиент отключится,
+            # остальные всё равно получат результат
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            return await asyncio.shield(task), False
+        self.hits += 1
+        return await asyncio.shield(task), True
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            # Сериализация и запись на диск — отдельной задачей, не в колбэке
+            write = asyncio.ensure_future(self.put(key, task.result()))
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
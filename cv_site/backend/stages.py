@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+END = object()  # маркер конца потока данных между стадиями
+
+
+class PipelineAborted(Exception):
+    """Стадия остановлена, потому что в другой стадии произошла ошибка."""
+
+
+class StagePipeline:
+    """
+    Стадии обработки в отдельных потоках, связанные ограниченными очередями.
+    Полная очередь блокирует предыдущую стадию (backpressure), поэтому
+    пропускная способность упирается в самую медленную стадию, а не в сумму.
+    Ошибка в любой стадии останавливает остальные и пробрасывается из join().
+    """
+
+    def __init__(self, poll_interval=0.1):
+        """:param poll_interval: как часто ждущая стадия проверяет остановку, сек"""
+        self.poll_interval = poll_interval
+        self.busy_time = defaultdict(float)  # стадия -> секунд полезной работы
+        self.items = defaultdict(int)  # стадия -> обработано элементов
+        self._aborted = threading.Event()
+        self._errors = []
+        self._threads = []
+        self._started = time.perf_counter()
+        self._finished = None
+
+    def put(self, q, item):
+        """Кладёт item в очередь, ожидая места; :raise PipelineAborted"""
+        while not self._aborted.is_set():
+            try:
+                q.put(item, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                continue
+        raise PipelineAborted
+
+    def get(self, q):
+        """Берёт элемент из очереди, ожидая его появления; :raise PipelineAborted"""
+        while not self._aborted.is_set():
+            try:
+                return q.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+        raise PipelineAborted
+
+    @contextmanager
+    def busy(self, stage):
+        """Учитывает время блока как работу стадии (ожидание очередей — нет)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy_time[stage] += time.perf_counter() - start
+
+    def run(self, target, *args):
+        """Выполняет стадию в текущем потоке; ошибка сохраняется до join()."""
+        try:
+            target(*args)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._aborted.set()
+
+    def spawn(self, stage, target, *args):
+        """Запускает стадию в отдельном потоке."""
+        thread = threading.Thread(
+            target=self.run, args=(target,) + args, name=stage, daemon=True
+        )
+        self._threads.append(thread)
+        thread.start()
+
+    def join(self):
+        """Дожидается всех стадий. :raise первую ошибку, возникшую в стадиях"""
+        for thread in self._threads:
+            thread.join()
+        self._finished = time.perf_counter()
+        if self._errors:
+            raise self._errors[0]
+
+    @property
+    def elapsed(self):
+        return (self._finished or time.perf_counter()) - self._started
+
+    def stats(self):
+        """Загрузка стадий: доля времени, занятая работой, а не ожиданием."""
+        elapsed = self.elapsed
+        return {
+            "elapsed_sec": round(elapsed, 3),
+            "stages": {
+                stage: {
+                    "busy_sec": round(busy, 3),
+                    "utilization": round(busy / elapsed, 3) if elapsed > 0 else 0.0,
+                    "items": self.items[stage],
+                }
+                for stage, busy in self.busy_time.items()
+            },
+        }
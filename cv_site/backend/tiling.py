@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+
+from detections import ColumnarDetections
+from postprocess import batched_nms, xywh_to_xyxy
+
+TILE_OVERLAP = 0.2
+# Бокс, лежащий внутри более уверенного бокса того же класса больше чем
+# на эту долю, считается обрезанным краем тайла и отбрасывается
+TILE_IOS_THRESHOLD = 0.8
+
+
+def tile_starts(length, tile_size, overlap):
+    """Начала тайлов вдоль одной оси; последний тайл прижат к краю кадра."""
+    if length <= tile_size:
+        return [0]
+    step = max(1, int(tile_size * (1 - overlap)))
+    starts = list(range(0, length - tile_size, step))
+    return starts + [length - tile_size]
+
+
+def tile_grid(height, width, tile_size, overlap=TILE_OVERLAP):
+    """:return: np.ndarray (T, 2) — левые верхние углы тайлов (x, y)"""
+    xs = tile_starts(width, tile_size, overlap)
+    ys = tile_starts(height, tile_size, overlap)
+    return np.array([(x, y) for y in ys for x in xs], dtype=np.int64).reshape(-1, 2)
+
+
+def make_tiles(frames, tile_size, overlap=TILE_OVERLAP):
+    """
+    Нарезает кадры на перекрывающиеся тайлы (без копирования — срезы кадров).
+    :return: (список тайлов, индекс кадра для каждого тайла, смещения (T, 2))
+    """
+    tiles, tile_frame, offsets = [], [], []
+    for frame_no, frame in enumerate(frames):
+        height, width = frame.shape[:2]
+        for x, y in tile_grid(height, width, tile_size, overlap).tolist():
+            tiles.append(frame[y : y + tile_size, x : x + tile_size])
+            tile_frame.append(frame_no)
+            offsets.append((x, y))
+    return (
+        tiles,
+        np.asarray(tile_frame, dtype=np.int64),
+        np.asarray(offsets, dtype=np.int64).reshape(-1, 2),
+    )
+
+
+def merge_tiles(tile_dets, tile_frame, offsets, num_frames, iou):
+    """
+    Переводит боксы тайлов в координаты кадров и склеивает дубликаты на
+    перекрытиях одним NMS по всем кадрам и классам сразу.
+    :param tile_dets: ColumnarDetections, frame_idx — индекс тайла
+    :return: ColumnarDetections, frame_idx — индекс кадра
+    """
+    start = time.perf_counter()
+    xywh = tile_dets.xywh.copy()
+    xywh[:, :2] += offsets[tile_dets.frame_idx]
+    frame_idx = tile_frame[tile_dets.frame_idx]
+    num_classes = max(
+        len(tile_dets.class_names), int(tile_dets.class_id.max(initial=0)) + 1
+    )
+    keep = batched_nms(
+        xywh_to_xyxy(xywh),
+        tile_dets.conf,
+        frame_idx * num_classes + tile_dets.class_id,
+        iou,
+        TILE_IOS_THRESHOLD,
+    )
+    keep = keep[np.lexsort((keep, frame_idx[keep]))]
+    merged = ColumnarDetections(
+        frame_idx[keep],
+        tile_dets.class_id[keep],
+        tile_dets.conf[keep],
+        xywh[keep],
+        tile_dets.class_names,
+        num_frames,
+    )
+    merged.timings = dict(tile_dets.timings)
+    merged.timings["merge"] = time.perf_counter() - start
+    return merged
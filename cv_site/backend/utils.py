@@ -1,6 +1,9 @@
 import os
 import time
 
+import cv2
+import numpy as np
+
 
 def cleanup_folder(folder, hours=24):
     now = time.time()
@@ -11,6 +14,22 @@ def cleanup_folder(folder, hours=24):
                 os.remove(path)
 
 
+def decode_image(data):
+    """
+    Декодирует байты изображения в BGR numpy-массив.
+    :return: np.ndarray (H, W, 3) или None, если файл повреждён
+    """
+    if not data:
+        return None
+    try:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        return None
+    if img is None or img.size == 0:
+        return None
+    return img
+
+
 if __name__ == "__main__":
     cleanup_folder("uploads", hours=24)
     cleanup_folder("outputs", hours=24)
@@ -0,0 +1,171 @@
+import os
+import subprocess
+
+import numpy as np
+
+
+def budget_bitrate(max_bytes, duration_sec, margin=0.9):
+    """
+    Битрейт видео (бит/с), при котором файл длительностью duration_sec
+    уложится в max_bytes; margin оставляет запас на контейнер.
+    :return: битрейт или None, если длительность неизвестна
+    """
+    if not max_bytes or not duration_sec or duration_sec <= 0:
+        return None
+    return int(max_bytes * 8 * margin / duration_sec)
+
+
+class FFmpegPipeWriter:
+    """
+    Кодирует кадры BGR в MP4 (H.264) за один проход: сырые кадры пишутся
+    в stdin процесса ffmpeg, без промежуточных файлов и перекодирований.
+    Метаданные (moov) переносятся в начало файла (+faststart), чтобы
+    видео начинало проигрываться в браузере до полной загрузки.
+    """
+
+    def __init__(
+        self,
+        output_path,
+        width,
+        height,
+        fps,
+        bitrate=None,
+        max_bitrate=None,
+        crf=23,
+        preset="veryfast",
+        ffmpeg="ffmpeg",
+    ):
+        """
+        :param bitrate: целевой битрейт, бит/с (кодирование с заданным битрейтом)
+        :param max_bitrate: верхняя граница битрейта при кодировании по качеству
+            (crf) — так размер файла не выходит за бюджет
+        :param crf: качество при кодировании без bitrate (меньше — лучше)
+        """
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        cmd = [
+            ffmpeg,
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(fps or 30),
+            "-i",
+            "-",
+            "-an",
+            "-c:v",
+            "libx264",
+            "-preset",
+            preset,
+            "-pix_fmt",
+            "yuv420p",
+            # yuv420p требует чётных сторон
+            "-vf",
+            "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        ]
+        if bitrate:
+            cmd += ["-b:v", str(bitrate), "-maxrate", str(bitrate)]
+            cmd += ["-bufsize", str(2 * bitrate)]
+        else:
+            cmd += ["-crf", str(crf)]
+            if max_bitrate:
+                cmd += ["-maxrate", str(max_bitrate), "-bufsize", str(2 * max_bitrate)]
+        cmd += ["-movflags", "+faststart", output_path]
+        self._proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    def write(self, frame):
+        """:param frame: np.ndarray (height, width, 3) uint8, BGR"""
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError(
+                f"Размер кадра {frame.shape[1]}x{frame.shape[0]} "
+                f"не совпадает с {self.width}x{self.height}"
+            )
+        try:
+            # Буфер кадра без копирования (копия только для несмежных view)
+            self._proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg завершился с ошибкой: {self._stderr()}")
+        self.frames_written += 1
+
+    def _stderr(self):
+        # Сначала дочитываем stderr до конца, иначе wait() может зависнуть
+        error = self._proc.stderr.read()
+        self._proc.wait()
+        return error.decode("utf-8", "replace").strip()
+
+    def close(self):
+        """Дожидается окончания кодирования. :raise RuntimeError при ошибке ffmpeg"""
+        if self._proc.stdin and not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        error = self._stderr()
+        if self._proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg завершился с ошибкой: {error}")
+
+    def abort(self):
+        """Прерывает кодирование и удаляет недописанный файл."""
+        self._proc.kill()
+        self._proc.wait()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def concat_videos(paths, output_path, ffmpeg="ffmpeg"):
+    """
+    Склеивает отрезки, закодированные с одинаковыми параметрами, без
+    перекодирования (concat demuxer, -c copy).
+    :raise RuntimeError: при ошибке ffmpeg
+    """
+    list_path = f"{output_path}.concat.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        ffmpeg,
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        list_path,
+        "-c",
+        "copy",
+        "-movflags",
+        "+faststart",
+        output_path,
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True)
+    finally:
+        os.remove(list_path)
+    if proc.returncode != 0:
+        error = proc.stderr.decode("utf-8", "replace").strip()
+        raise RuntimeError(f"ffmpeg завершился с ошибкой: {error}")
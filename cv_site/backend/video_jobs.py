@@ -0,0 +1,243 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Статусы задания
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINAL_STATUSES = {DONE, FAILED, CANCELLED}
+
+_COLUMNS = (
+    "id",
+    "status",
+    "model",
+    "confidence",
+    "iou",
+    "upload_path",
+    "output_path",
+    "result_path",
+    "frames_done",
+    "total_frames",
+    "fps",
+    "error",
+    "created_at",
+    "updated_at",
+)
+
+
+class QueueFullError(Exception):
+    """Очередь видео-заданий заполнена."""
+
+
+class VideoJobStore:
+    """Хранилище заданий в SQLite: переживает перезапуск бэкенда."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                model TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                iou REAL NOT NULL,
+                upload_path TEXT,
+                output_path TEXT,
+                result_path TEXT,
+                frames_done INTEGER NOT NULL DEFAULT 0,
+                total_frames INTEGER NOT NULL DEFAULT 0,
+                fps REAL NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def create(self, **fields):
+        now = time.time()
+        job = dict.fromkeys(_COLUMNS)
+        job.update(frames_done=0, total_frames=0, fps=0.0)
+        job.update(fields, id=uuid.uuid4().hex, status=QUEUED, created_at=now, updated_at=now)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                [job[c] for c in _COLUMNS],
+            )
+            self._conn.commit()
+        return job
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                [*fields.values(), job_id],
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def interrupted(self):
+        """Задания, которые не успели завершиться до остановки сервера."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class VideoJobQueue:
+    """
+    Очередь видео-заданий с ограниченной глубиной.
+    Обработку выполняет process(job, progress) — async-функция, которая
+    вызывает progress(frames_done, total_frames, fps) по мере работы.
+    """
+
+    def __init__(self, store, process, max_queue=8, workers=1, progress_interval=1.0):
+        self.store = store
+        self.process = process
+        self.max_queue = max_queue
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self._queue = None
+        self._tasks = []
+        self._running = {}  # job_id -> asyncio.Task
+        self._cancelled = set()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # После перезапуска незавершённые задания продолжить нельзя
+        for job in self.store.interrupted():
+            self.store.update(
+                job["id"], status=FAILED, error="Прервано перезапуском сервера"
+            )
+            _remove(job["upload_path"])
+        self._tasks = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, **fields):
+        """Создаёт задание и ставит его в очередь. :raise QueueFullError"""
+        if self._queue.full():
+            raise QueueFullError("Очередь видео-заданий заполнена")
+        job = self.store.create(**fields)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    def cancel(self, job_id):
+        """
+        Отменяет задание.
+        :return: False, если задание уже завершено
+        """
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINAL_STATUSES:
+            return False
+        self._cancelled.add(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            self.store.update(job_id, status=CANCELLED)
+            _remove(job["upload_path"])
+        return True
+
+    def status(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        remaining = max(job["total_frames"] - job["frames_done"], 0)
+        eta = None
+        if job["status"] == RUNNING and job["fps"] > 0:
+            eta = round(remaining / job["fps"], 1)
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "model": job["model"],
+            "frames_done": job["frames_done"],
+            "total_frames": job["total_frames"],
+            "fps": round(job["fps"], 2),
+            "eta_sec": eta,
+            "error": job["error"],
+        }
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                if job_id in self._cancelled:
+                    continue
+                await self._run(job_id)
+            finally:
+                self._cancelled.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        job = self.store.get(job_id)
+        self.store.update(job_id, status=RUNNING)
+        last_saved = 0.0
+
+        def progress(frames_done, total_frames, fps):
+            nonlocal last_saved
+            now = time.monotonic()
+            # Прогресс пишем в SQLite не чаще раза в progress_interval
+            if now - last_saved >= self.progress_interval:
+                last_saved = now
+                self.store.update(
+                    job_id, frames_done=frames_done, total_frames=total_frames, fps=fps
+                )
+
+        task = asyncio.ensure_future(self.process(job, progress))
+        self._running[job_id] = task
+        try:
+            frames_done, fps = await task
+            self.store.update(job_id, status=DONE, frames_done=frames_done, fps=fps)
+        except asyncio.CancelledError:
+            if job_id not in self._cancelled:
+                raise
+            self.store.update(job_id, status=CANCELLED)
+            _remove(job["result_path"])
+        except Exception as e:
+            self.store.update(job_id, status=FAILED, error=str(e))
+            _remove(job["result_path"])
+        finally:
+            self._running.pop(job_id, None)
+            _remove(job["upload_path"])
+
+
+def _remove(path):
+    if path and os.path.exists(path):
+        os.remove(path)
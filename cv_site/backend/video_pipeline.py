@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+import cv2
+
+
+class VideoFramePipeline:
+    """
+    Читает кадры из cv2.VideoCapture батчами numpy-массивов (без записи
+    кадров на диск) и считает собственную пропускную способность.
+    """
+
+    def __init__(
+        self,
+        video_path,
+        batch_size=16,
+        max_frames=None,
+        first_batch_size=None,
+        on_batch=None,
+    ):
+        """
+        :param video_path: путь к видеофайлу
+        :param batch_size: сколько кадров отдавать модели за один forward pass
+        :param max_frames: ограничение на число кадров (None или 0 — без ограничения)
+        :param first_batch_size: размер первого батча; маленький первый батч
+            сокращает время до первого результата при стриминге
+        :param on_batch: функция (кадров, сек. декодирования, сек. инференса),
+            вызывается после каждого батча — например, для метрик
+        """
+        self.video_path = video_path
+        self.batch_size = max(1, int(batch_size))
+        self.first_batch_size = max(1, int(first_batch_size or self.batch_size))
+        self.on_batch = on_batch
+        self.max_frames = max_frames or None
+        self.cap = cv2.VideoCapture(video_path)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frames_done = 0
+        self._frames_read = 0
+        self.decode_time = 0.0
+        self.infer_time = 0.0
+        self._started = None
+        self._finished = None
+        self._read_task = None  # чтение батча в потоке, если оно идёт
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    @property
+    def total_frames(self):
+        """Сколько кадров будет обработано (по метаданным контейнера)."""
+        if self.max_frames and self.frame_count > 0:
+            return min(self.frame_count, self.max_frames)
+        return self.max_frames or self.frame_count
+
+    def release(self):
+        """
+        Освобождает VideoCapture. Если батч ещё читается в потоке (задачу
+        отменили посреди чтения), release откладывается до конца чтения:
+        release() во время read() того же VideoCapture может уронить процесс.
+        """
+        task = self._read_task
+        if task is not None and not task.done():
+            task.add_done_callback(self._release_after_read)
+        else:
+            self.cap.release()
+
+    def _release_after_read(self, task):
+        if not task.cancelled():
+            task.exception()  # результат уже никому не нужен
+        self.cap.release()
+
+    def read_batch(self):
+        """
+        Читает следующий батч кадров.
+        :return: (индекс первого кадра, список кадров) или None, если кадры кончились
+        """
+        start = time.perf_counter()
+        first_idx = self._frames_read
+        limit = self.first_batch_size if first_idx == 0 else self.batch_size
+        frames = []
+        while len(frames) < limit:
+            if self.max_frames and self._frames_read >= self.max_frames:
+                break
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+            self._frames_read += 1
+        self.decode_time += time.perf_counter() - start
+        if not frames:
+            return None
+        return first_idx, frames
+
+    async def detect_batches(self, predict_batch):
+        """
+        Асинхронный генератор детекций по батчам.
+        :param predict_batch: async-функция (frames) -> список детекций по кадрам
+        :yield: (индекс первого кадра батча, список детекций по кадрам)
+        """
+        self._started = time.perf_counter()
+        try:
+            while True:
+                # Декодирование блокирующее — выполняем вне event loop
+                start = time.perf_counter()
+                # shield: при отмене генератора поток дочитывает батч сам,
+                # а release() дождётся его завершения
+                self._read_task = asyncio.ensure_future(
+                    asyncio.to_thread(self.read_batch)
+                )
+                batch = await asyncio.shield(self._read_task)
+                decode_time = time.perf_counter() - start
+                if batch is None:
+                    break
+                first_idx, frames = batch
+                start = time.perf_counter()
+                dets = await predict_batch(frames)
+                infer_time = time.perf_counter() - start
+                self.infer_time += infer_time
+                self.frames_done += len(frames)
+                if self.on_batch is not None:
+                    self.on_batch(len(frames), decode_time, infer_time)
+                yield first_idx, dets
+        finally:
+            self._finished = time.perf_counter()
+            self.release()
+
+    async def detect(self, predict_batch):
+        """
+        Асинхронный генератор детекций по кадрам.
+        :yield: (индекс кадра, детекции кадра)
+        """
+        async for first_idx, dets in self.detect_batches(predict_batch):
+            for offset, frame_dets in enumerate(dets):
+                yield first_idx + offset, frame_dets
+
+    @property
+    def elapsed(self):
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.perf_counter()) - self._started
+
+    @property
+    def throughput(self):
+        """Обработанных кадров в секунду."""
+        elapsed = self.elapsed
+        return self.frames_done / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            "frames": self.frames_done,
+            "batch_size": self.batch_size,
+            "elapsed_sec": round(self.elapsed, 3),
+            "decode_sec": round(self.decode_time, 3),
+            "infer_sec": round(self.infer_time, 3),
+            "fps": round(self.throughput, 2),
+        }
@@ -0,0 +1,77 @@
+import bisect
+import os
+import subprocess
+
+
+def available_cores():
+    """Число ядер, доступных процессу (с учётом affinity/cgroup cpuset)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def probe_keyframes(video_path, fps, ffprobe="ffprobe"):
+    """
+    Индексы ключевых кадров видео. ffprobe декодирует только ключевые кадры
+    (-skip_frame nokey), поэтому это быстро даже для длинных роликов.
+    :return: отсортированный список индексов кадров; :raise RuntimeError
+    """
+    cmd = [
+        ffprobe,
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-skip_frame",
+        "nokey",
+        "-show_entries",
+        "frame=best_effort_timestamp_time",
+        "-of",
+        "csv=p=0",
+        video_path,
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe завершился с ошибкой: {proc.stderr.strip()}")
+    times = []
+    for line in proc.stdout.split():
+        try:
+            times.append(float(line.strip(",")))
+        except ValueError:
+            continue
+    if not times:
+        return [0]
+    # Первый кадр всегда ключевой: считаем от его метки времени
+    start = min(times)
+    return sorted({int(round((t - start) * fps)) for t in times})
+
+
+def plan_shards(keyframes, frame_count, shards, min_frames=1):
+    """
+    Делит видео на shards отрезков примерно равной длины с границами на
+    ключевых кадрах — каждый отрезок декодируется независимо.
+    :param min_frames: отрезки короче не выделяются
+    :return: список (первый кадр, конец отрезка) с концом не включительно
+    """
+    keyframes = sorted(k for k in keyframes if 0 < k < frame_count)
+    bounds = []
+    for i in range(1, shards):
+        target = frame_count * i / shards
+        pos = bisect.bisect_left(keyframes, target)
+        near = keyframes[max(0, pos - 1) : pos + 1]
+        if not near:
+            continue
+        bound = min(near, key=lambda k: abs(k - target))
+        if bound - (bounds[-1] if bounds else 0) >= min_frames:
+            bounds.append(bound)
+    if bounds and frame_count - bounds[-1] < min_frames:
+        bounds.pop()
+    edges = [0] + bounds + [frame_count]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def shard_threads(workers, cores=None):
+    """Потоков ONNX Runtime на воркер, чтобы воркеры не делили одни ядра."""
+    cores = cores or available_cores()
+    return max(1, cores // max(1, workers))
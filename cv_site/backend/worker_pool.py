@@ -0,0 +1,289 @@
+import asyncio
+import collections
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from detections import ColumnarDetections
+
+_ALIGN = 64
+
+
+class PoolBusyError(Exception):
+    """Очередь инференса заполнена — запрос не принят."""
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _pack_frames(buf, frames):
+    """
+    Копирует кадры в буфер shared memory.
+    :return: метаданные [(offset, shape, dtype), ...] для восстановления кадров
+    """
+    meta = []
+    offset = 0
+    for frame in frames:
+        frame = np.ascontiguousarray(frame)
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=buf, offset=offset)
+        view[...] = frame
+        meta.append((offset, frame.shape, frame.dtype.str))
+        offset += _aligned(frame.nbytes)
+    return meta
+
+
+def _unpack_frames(buf, meta):
+    """Возвращает кадры как view на shared memory, без копирования."""
+    return [
+        np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf, offset=offset)
+        for offset, shape, dtype in meta
+    ]
+
+
+def _chunk_frames(frames, slot_bytes):
+    """Делит кадры на группы, каждая из которых помещается в один слот."""
+    chunk, size = [], 0
+    for frame in frames:
+        n = _aligned(frame.nbytes)
+        if n > slot_bytes:
+            raise ValueError(
+                f"Кадр {frame.shape} не помещается в слот shared memory "
+                f"({slot_bytes // (1024 * 1024)} МБ)"
+            )
+        if chunk and size + n > slot_bytes:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(frame)
+        size += n
+    if chunk:
+        yield chunk
+
+
+def _worker_main(model_specs, memory_budget, slot_names, jobs, results, num_threads):
+    """Цикл процесса-воркера: свой реестр моделей, кадры читаются из shared memory."""
+    from detectors import load_detector
+    from model_registry import ModelRegistry
+
+    slots = []
+    for name in slot_names:
+        shm = shared_memory.SharedMemory(name=name)
+        # Сегментами владеет главный процесс, воркер не должен их удалять
+        resource_tracker.unregister(shm._name, "shared_memory")
+        slots.append(shm)
+    # Делим ядра между воркерами, чтобы они не конкурировали за потоки
+    registry = ModelRegistry(
+        {name: spec[1] for name, spec in model_specs.items()},
+        lambda name, path: load_detector(
+            model_specs[name][0], path, num_threads=num_threads, **model_specs[name][2]
+        ),
+        memory_budget_bytes=memory_budget,
+    )
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, slot, meta, model, confidence, iou = job
+        try:
+            detector = registry.get(model)
+            frames = _unpack_frames(slots[slot].buf, meta)
+            dets = detector.detect_batch(frames, confidence, iou)
+            results.put((job_id, True, dets))
+        except Exception as e:
+            results.put((job_id, False, f"{type(e).__name__}: {e}"))
+
+
+class InferenceWorkerPool:
+    """
+    Пул процессов инференса. Каждый процесс держит свои модели, кадры
+    передаются через заранее выделенные слоты shared memory, задания —
+    через очередь воркера. Свободный слот — это и есть право поставить
+    задание в очередь: если слотов нет дольше acquire_timeout, запрос
+    отклоняется с PoolBusyError.
+    Поток чтения результатов следит за воркерами: задания упавшего воркера
+    (OOM, segfault) завершаются ошибкой, их слоты освобождаются, а воркер
+    перезапускается.
+    """
+
+    def __init__(
+        self,
+        model_specs,
+        num_workers,
+        queue_size=16,
+        slot_bytes=64 * 1024 * 1024,
+        memory_budget=0,
+        acquire_timeout=30.0,
+        health_interval=1.0,
+    ):
+        """
+        :param model_specs: {имя модели: (бэкенд, путь, параметры детектора)}
+        :param memory_budget: бюджет памяти на модели всего пула, байты
+            (0 — без ограничения); делится между воркерами поровну
+        :param health_interval: как часто проверять, живы ли воркеры, сек.
+        """
+        self.model_specs = dict(model_specs)
+        self.memory_budget = memory_budget
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.slot_bytes = slot_bytes
+        self.acquire_timeout = acquire_timeout
+        self.health_interval = health_interval
+        self.restarts = 0
+        self._ids = itertools.count()
+        self._pending = {}  # job_id -> (future, slot, индекс воркера)
+        self._slots = []
+        # (процесс, его очередь заданий): у каждого воркера своя очередь,
+        # поэтому известно, чьи задания пропали при его падении
+        self._workers = []
+        self._loop = None
+        self._reader = None
+        self._stopping = False
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def start(self):
+        self._ctx = mp.get_context("spawn")
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        n_slots = self.queue_size + self.num_workers
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+            for _ in range(n_slots)
+        ]
+        self._free_slots = asyncio.Queue()
+        for i in range(n_slots):
+            self._free_slots.put_nowait(i)
+        self._results = self._ctx.Queue()
+        self._num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        # Иначе у N воркеров в памяти может оказаться N бюджетов моделей
+        self._worker_budget = self.memory_budget and max(
+            1, self.memory_budget // self.num_workers
+        )
+        self._workers = [self._spawn() for _ in range(self.num_workers)]
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+    def _spawn(self):
+        jobs = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                self.model_specs,
+                self._worker_budget,
+                [shm.name for shm in self._slots],
+                jobs,
+                self._results,
+                self._num_threads,
+            ),
+            daemon=True,
+        )
+        proc.start()
+        return proc, jobs
+
+    def stop(self):
+        self._stopping = True
+        for _, jobs in self._workers:
+            jobs.put(None)
+        for proc, _ in self._workers:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._workers = []
+        if self._reader is not None:
+            self._results.put(None)
+            self._reader.join(timeout=5)
+        # Ответов на оставшиеся задания уже не будет
+        self._fail_jobs(list(self._pending), "Пул инференса остановлен")
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+
+    def _read_results(self):
+        while True:
+            try:
+                item = self._results.get(timeout=self.health_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._loop.call_soon_threadsafe(self._complete, *item)
+            for index, (proc, _) in enumerate(list(self._workers)):
+                if not proc.is_alive():
+                    self._loop.call_soon_threadsafe(self._worker_died, index, proc)
+
+    def _worker_died(self, index, proc):
+        # Проверка из потока чтения могла сработать несколько раз
+        if self._stopping or index >= len(self._workers):
+            return
+        if self._workers[index][0] is not proc:
+            return
+        lost = [job_id for job_id, job in self._pending.items() if job[2] == index]
+        print(
+            f"Воркер инференса {index} завершился с кодом {proc.exitcode}, "
+            f"потеряно заданий: {len(lost)}; перезапуск"
+        )
+        self._fail_jobs(lost, f"Воркер инференса упал (код {proc.exitcode})")
+        self._workers[index] = self._spawn()
+        self.restarts += 1
+
+    def _fail_jobs(self, job_ids, message):
+        for job_id in job_ids:
+            future, slot, _ = self._pending.pop(job_id)
+            self._free_slots.put_nowait(slot)
+            if not future.done():
+                future.set_exception(RuntimeError(message))
+
+    def _complete(self, job_id, ok, payload):
+        future, slot, _ = self._pending.pop(job_id, (None, None, None))
+        if future is None:
+            return
+        # Слот освобождаем только здесь: пока воркер не ответил, он читает слот
+        self._free_slots.put_nowait(slot)
+        if future.done():
+            return
+        if ok:
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    async def _submit_chunk(self, model, frames, confidence, iou):
+        try:
+            slot = await asyncio.wait_for(self._free_slots.get(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolBusyError("Очередь инференса переполнена")
+        try:
+            meta = _pack_frames(self._slots[slot].buf, frames)
+        except Exception:
+            self._free_slots.put_nowait(slot)
+            raise
+        if self._stopping:
+            self._free_slots.put_nowait(slot)
+            raise PoolBusyError("Пул инференса остановлен")
+        # Задание получает наименее загруженный воркер
+        load = collections.Counter(job[2] for job in self._pending.values())
+        index = min(range(len(self._workers)), key=lambda i: load[i])
+        job_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[job_id] = (future, slot, index)
+        self._workers[index][1].put_nowait((job_id, slot, meta, model, confidence, iou))
+        return await future
+
+    async def submit(self, model, frames, confidence, iou):
+        """
+        Отправляет кадры на инференс в пул.
+        :return: ColumnarDetections, frame_idx — индекс кадра в frames
+        """
+        chunks = list(_chunk_frames(frames, self.slot_bytes))
+        results = await asyncio.gather(
+            *(self._submit_chunk(model, chunk, confidence, iou) for chunk in chunks)
+        )
+        return ColumnarDetections.concat(results)